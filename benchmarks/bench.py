@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+# bench.py -- Benchmarks pycdm against the local mock server in mockcdm.py.
+# For each data size a mock collection of that many items, and one of compound objects of
+# that many pages, are served, and every case is run in its own process, reporting the
+# API calls it made, wall time and peak memory growth.
+#
+#   $ python bench.py --sizes 100,1000 --latency 0.005
+#   $ python bench.py --only item,export --repeat 3
+
+import os
+import sys
+import json
+import time
+import shutil
+import urllib2
+import optparse
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+def ids(store, kind):
+    """Returns the ids of top level items of a kind ('single', 'Document' or 'Monograph')."""
+    found = []
+    for id in store.collections[ALIAS]['ids']:
+        compound = store.compound.get((ALIAS, id))
+        if (compound['type'] if compound else 'single') == kind:
+            found.append(id)
+    return found
+
+
+def singleitem(store, size):
+    for id in ids(store, 'single')[:size]:
+        pycdm.item(ALIAS, str(id))
+
+
+def document(store, size):
+    pycdm.item(ALIAS, str(ids(store, 'Document')[0]), pageinfo='on')
+
+
+def monograph(store, size):
+    pycdm.item(ALIAS, str(ids(store, 'Monograph')[0]), pageinfo='on')
+
+
+def collection(store, size):
+    pycdm.Collection(ALIAS)
+
+
+def getitems(store, size):
+    pycdm.collections.load(ALIAS).getItems()
+
+
+def dcinfo(store, size):
+    infos = [store.records[(ALIAS, id)] for id in store.collections[ALIAS]['ids']]
+    pycdm.dcinfos(ALIAS, infos)
+
+
+def export(store, size):
+    path = tempfile.mkdtemp()
+    try:
+        itemids = [str(id) for id in store.collections[ALIAS]['ids']]
+        pycdm.export(pycdm.items(ALIAS, itemids, pageinfo='on'), os.path.join(path, 'pages.csv'), level='page')
+    finally:
+        shutil.rmtree(path)
+
+
+# name, function, served collection ('items' or 'pages')
+CASES = [
+    ('item', singleitem, 'items'),          # item() of `size` single page items
+    ('document', document, 'pages'),        # item() of a Document of `size` pages, pageinfo='on'
+    ('monograph', monograph, 'pages'),      # item() of a deep Monograph of `size` pages, pageinfo='on'
+    ('collection', collection, 'items'),    # Collection() with vocabularies
+    ('getitems', getitems, 'items'),        # Collection.getItems() of `size` items
+    ('dcinfo', dcinfo, 'items'),            # dcinfo of `size` items
+    ('export', export, 'items'),            # CSV export of the pages of `size` items, pageinfo='on'
+]
+
+
+def stats(server):
+    return json.loads(urllib2.urlopen('http://127.0.0.1:%d/_stats' % server.server_port).read())
+
+
+def run(func, store, size, server, results):
+    """Runs one case in a child process and sends back (API calls, seconds, peak memory growth in KB)."""
+    pycdm.base = 'http://127.0.0.1'
+    pycdm.port = ':%d' % server.server_port
+    before = stats(server)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    func(store, size)
+    elapsed = time.time() - started
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    after = stats(server)
+    # the two /_stats requests are not API calls
+    calls = after['requests'] - before['requests'] - 1
+    results.put((calls, elapsed, rss))
+
+
+def bench(name, func, store, size, server):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run, args=(func, store, size, server, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('%s failed at size %d' % (name, size))
+    return results.get()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='100,1000', help='comma separated numbers of items/pages')
+    parser.add_option('--only', default='', help='comma separated cases to run: ' +
+                      ', '.join(case[0] for case in CASES))
+    parser.add_option('--latency', type='float', default=0, help='seconds of latency added to every request')
+    parser.add_option('--jitter', type='float', default=0, help='up to this many more seconds of random latency')
+    parser.add_option('--errors', type='float', default=0, help='fraction of requests answered with a 503')
+    parser.add_option('--pages', type='int', default=10, help='pages per compound object of the items collection')
+    parser.add_option('--depth', type='int', default=4, help='node depth of monographs')
+    parser.add_option('--repeat', type='int', default=1, help='runs per case; the fastest is reported')
+    opts, args = parser.parse_args()
+    only = [name for name in opts.only.split(',') if name]
+    cases = [case for case in CASES if not only or case[0] in only]
+    print '%-12s %8s %8s %10s %10s' % ('case', 'size', 'calls', 'seconds', 'peak KB')
+    for size in [int(size) for size in opts.sizes.split(',')]:
+        settings = dict(latency=opts.latency, errors=opts.errors, jitter=opts.jitter, depth=opts.depth)
+        # seven items hold a Document and a Monograph
+        servers = {'items': mockcdm.serve(items=size, pages=opts.pages, **settings),
+                   'pages': mockcdm.serve(items=7, pages=size, **settings)}
+        try:
+            for name, func, served in cases:
+                server = servers[served]
+                runs = [bench(name, func, server.store, size, server) for n in range(opts.repeat)]
+                calls, elapsed, rss = min(runs, key=lambda result: result[1])
+                print '%-12s %8d %8d %10.3f %10d' % (name, size, calls, elapsed, rss)
+                sys.stdout.flush()
+        finally:
+            for server in servers.values():
+                server.shutdown()
+                server.server_close()
+
+
+if __name__ == '__main__':
+    main()
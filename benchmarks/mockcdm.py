@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+# mockcdm.py -- A local stand-in for the CONTENTdm dmwebservices API.
+# Serves synthetic collections of single page items, documents and (deep) monographs
+# for the endpoints pycdm.Api uses, with configurable latency and error injection, so
+# pycdm can be tried and benchmarked without touching a production server.
+#
+#   $ python mockcdm.py --port 8081 --items 1000 --pages 20 --latency 0.01
+#
+# then point pycdm at it:
+#
+#   pycdm.base = 'http://127.0.0.1'
+#   pycdm.port = ':8081'
+#
+# GET /_stats returns the number of requests served per API function, /_reset zeroes them.
+
+import sys
+import json
+import collections
+import time
+import random
+import re
+import zlib
+import threading
+import optparse
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+VOCAB = [u'Letters', u'Diaries', u'Cookbooks', u'Photographs', u'Maps', u'Caf&eacute; menus']
+FIELDS = [
+    # name, nick, dc, req, search, hide, vocab
+    (u'Title', u'title', u'title', 1, 1, 0, 0),
+    (u'Creator', u'creato', u'creato', 0, 1, 0, 0),
+    (u'Subject', u'subjec', u'subjec', 0, 1, 0, 1),
+    (u'Type', u'type', u'type', 0, 1, 0, 1),
+    (u'Description', u'descri', u'descri', 0, 1, 0, 0),
+    (u'Transcript', u'transc', u'', 0, 1, 0, 0),
+    (u'Rights', u'rights', u'rights', 1, 0, 0, 0),
+    (u'Date created', u'dmcreated', u'', 0, 0, 1, 0),
+    (u'Date modified', u'dmmodified', u'', 0, 0, 1, 0),
+    (u'CONTENTdm number', u'dmrecord', u'', 0, 0, 1, 0),
+    (u'CONTENTdm file name', u'find', u'', 0, 0, 1, 0),
+]
+
+
+class Store:
+    """Synthetic collections.
+
+    Every seventh item is a Monograph, with its pages spread over nodes nested `depth`
+    levels deep, and every third other item a Document; the rest are single page items.
+    Page ids of compound objects follow their parent item ids.
+    """
+    def __init__(self, collections=1, items=100, pages=10, depth=2, urlfiles=0):
+        self.collections = {}
+        self.records = {}
+        self.compound = {}
+        self.parents = {}
+        for c in range(collections):
+            alias = 'coll%d' % c
+            self.collections[alias] = {'name': u'Collection %d' % c, 'ids': []}
+            ptr = 0
+            for i in range(items):
+                ptr += 1
+                id = ptr
+                self.collections[alias]['ids'].append(id)
+                self.parents[(alias, id)] = -1
+                kind = 'single'
+                if i % 7 == 6:
+                    kind = 'Monograph'
+                elif i % 3 == 2:
+                    kind = 'Document'
+                if kind == 'single':
+                    find = '%d.jpg' % id
+                    if urlfiles and i % urlfiles == 0:
+                        find = '%d.url' % id
+                    self.records[(alias, id)] = self.record(alias, id, u'Item %d' % id, find)
+                    continue
+                self.records[(alias, id)] = self.record(alias, id, u'Item %d &amp; pages' % id, '%d.cpd' % id)
+                pageids = []
+                for p in range(pages):
+                    ptr += 1
+                    pageids.append(ptr)
+                    self.parents[(alias, ptr)] = id
+                    self.records[(alias, ptr)] = self.record(alias, ptr, u'Page %d' % (p + 1), '%d.jp2' % ptr)
+                pagelist = [{'pagetitle': u'Page %d' % (n + 1), 'pagefile': '%d.jp2' % pid, 'pageptr': str(pid)}
+                            for n, pid in enumerate(pageids)]
+                if kind == 'Document':
+                    self.compound[(alias, id)] = {'type': 'Document', 'page': pagelist}
+                else:
+                    self.compound[(alias, id)] = {'type': 'Monograph', 'node': self.nest(pagelist, depth, 1)}
+
+    def nest(self, pages, depth, level):
+        """Builds nodes `depth` levels deep over pages: each level holds an equal share of
+        the pages, and all but the last a node for the next level."""
+        title = u'Part %d' % level
+        if depth <= 1 or len(pages) < 2:
+            return collections.OrderedDict([('nodetitle', title), ('page', pages)])
+        share = max(len(pages) // depth, 1)
+        node = collections.OrderedDict([('nodetitle', title), ('page', pages[:share])])
+        node['node'] = self.nest(pages[share:], depth - 1, level + 1)
+        return node
+
+    def record(self, alias, id, title, find):
+        day = 1 + id % 28
+        return {
+            'title': title,
+            'creato': u'Hunt, Leigh, 1784-1859; Mayne, Colburn',
+            'subjec': u'%s;%s' % (VOCAB[id % len(VOCAB)], VOCAB[(id + 1) % len(VOCAB)]),
+            'type': u'Text',
+            'descri': {} if id % 5 == 0 else u'A description of record %d &quot;quoted&quot;' % id,
+            'transc': u'Dear Sir; your kind letter followed me &amp; reached me. ' * 3,
+            'rights': u'Public domain &copy; The University',
+            'dmcreated': u'2013-01-%02d' % day,
+            'dmmodified': u'2014-02-%02d' % day,
+            'dmrecord': str(id),
+            'find': find,
+        }
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers dmwebservices requests (index.php?q=function/arg/.../json) from the Store."""
+    protocol_version = 'HTTP/1.1'
+    # buffer each response into a single write
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.head = False
+        self.respond()
+
+    def do_HEAD(self):
+        self.head = True
+        self.respond()
+
+    def respond(self):
+        server = self.server
+        with server.lock:
+            server.stats['requests'] += 1
+        parts = urlparse.urlsplit(self.path)
+        if parts.path == '/_stats':
+            return self.send(200, json.dumps(server.stats))
+        if parts.path == '/_reset':
+            with server.lock:
+                server.stats.clear()
+                server.stats['requests'] = 0
+            return self.send(200, '{}')
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.random() * server.jitter)
+        if server.errors and random.random() < server.errors:
+            return self.send(503, 'Service Unavailable')
+        if parts.path.startswith('/utils/'):
+            return self.sendfile(self.path)
+        if not parts.query.startswith('q='):
+            return self.send(404, 'Not Found')
+        args = parts.query[2:].split('/')
+        function = args[0]
+        with server.lock:
+            server.stats[function] = server.stats.get(function, 0) + 1
+        handler = getattr(self, function, None)
+        if handler is None:
+            return self.send(404, 'Not Found')
+        try:
+            body = handler(server.store, *args[1:-1])
+        except (KeyError, ValueError, IndexError):
+            body = {'code': '-2', 'message': 'Requested item not found'}
+        self.send(200, json.dumps(body))
+
+    def send(self, status, body, ctype='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(body)
+
+    def sendfile(self, path):
+        """Serves a file of 1-64 KB, made up from its path, honouring Range requests."""
+        size = 1024 * (1 + (zlib.crc32(path) & 0xffffffff) % 64)
+        body = (path * (size // len(path) + 1))[:size]
+        match = re.match(r'bytes=(\d+)-$', self.headers.getheader('Range') or '')
+        if match is None:
+            return self.send(200, body, 'image/jpeg', [('Accept-Ranges', 'bytes')])
+        start = int(match.group(1))
+        if start >= size:
+            return self.send(416, '', 'image/jpeg', [('Content-Range', 'bytes */%d' % size)])
+        self.send(206, body[start:], 'image/jpeg', [('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size))])
+
+    def dmGetCollectionList(self, store):
+        return [{'alias': '/' + a, 'name': c['name'], 'path': '/cdm/' + a}
+                for a, c in sorted(store.collections.items())]
+
+    def dmGetDublinCoreFieldInfo(self, store):
+        return [{'name': f[0], 'nick': f[2]} for f in FIELDS if f[2]]
+
+    def dmGetCollectionParameters(self, store, alias):
+        return {'name': store.collections[alias]['name'], 'path': '/cdm/' + alias, 'rc': 0}
+
+    def dmGetCollectionFieldInfo(self, store, alias):
+        store.collections[alias]
+        return [{'name': f[0], 'nick': f[1], 'dc': f[2], 'req': f[3], 'search': f[4], 'hide': f[5],
+                 'vocab': f[6], 'type': 'TEXT', 'size': 0, 'find': 'a0', 'admin': 0, 'readonly': 0,
+                 'vocdb': ''} for f in FIELDS]
+
+    def dmGetCollectionFieldVocabulary(self, store, alias, nick):
+        store.collections[alias]
+        return VOCAB
+
+    def dmGetItemInfo(self, store, alias, id):
+        return store.records[(alias, int(id))]
+
+    def dmGetCompoundObjectInfo(self, store, alias, id):
+        key = (alias, int(id))
+        store.records[key]
+        if key in store.compound:
+            return store.compound[key]
+        return {'code': '-2', 'message': 'Requested item is not compound'}
+
+    def GetParent(self, store, alias, id):
+        return {'parent': store.parents[(alias, int(id))]}
+
+    def dmGetItemUrl(self, store, alias, find):
+        return {'URL': 'http://example.org/resource/%s\r\n' % find}
+
+    def dmQuery(self, store, alias, search, fields, sortby, maxrecs, start, *rest):
+        aliases = sorted(store.collections) if alias == 'all' else alias.split('!')
+        ids = [(a, id) for a in aliases for id in store.collections[a]['ids']]
+        terms = search.split('^')
+        if len(terms) >= 2 and terms[0] not in ('CISOSEARCHALL', '') and terms[1] not in ('0', '*', ''):
+            field, value = terms[0], terms[1].replace('+', ' ').lower()
+            ids = [k for k in ids if value in unicode(store.records[k].get(field, '')).lower()]
+        start, maxrecs = max(int(start), 1), int(maxrecs)
+        nicks = [f for f in fields.split('!') if f]
+        records = []
+        for a, id in ids[start - 1:start - 1 + maxrecs]:
+            rec = store.records[(a, id)]
+            r = {'collection': '/' + a, 'pointer': id, 'filetype': rec['find'].split('.')[-1],
+                 'parentobject': -1, 'find': rec['find']}
+            for n in nicks:
+                r[n] = rec.get(n, {})
+            records.append(r)
+        return {'pager': {'start': str(start), 'maxrecs': str(maxrecs), 'total': len(ids)}, 'records': records}
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, store, latency=0, errors=0, jitter=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0}
+
+
+    def handle_error(self, request, client_address):
+        # clients dropping keep-alive connections is expected
+        pass
+
+
+def serve(port=0, latency=0, errors=0, jitter=0, **kwds):
+    """Starts a mock server in a background thread and returns it.
+
+    Keywords other than latency, errors and jitter are passed to Store. server.server_port
+    holds the port and server.stats the requests served per API function."""
+    server = Server(('127.0.0.1', port), Store(**kwds), latency, errors, jitter)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8081)
+    parser.add_option('--collections', type='int', default=1)
+    parser.add_option('--items', type='int', default=100)
+    parser.add_option('--pages', type='int', default=10)
+    parser.add_option('--depth', type='int', default=2)
+    parser.add_option('--urlfiles', type='int', default=0, help='make every nth single page item a .url file')
+    parser.add_option('--latency', type='float', default=0, help='seconds of latency added to every request')
+    parser.add_option('--jitter', type='float', default=0, help='up to this many more seconds of random latency')
+    parser.add_option('--errors', type='float', default=0, help='fraction of requests answered with a 503')
+    opts, args = parser.parse_args()
+    server = Server(('127.0.0.1', opts.port), Store(opts.collections, opts.items, opts.pages, opts.depth,
+                    opts.urlfiles), opts.latency, opts.errors, opts.jitter)
+    print 'Serving mock dmwebservices on http://127.0.0.1:%d' % opts.port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
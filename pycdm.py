@@ -21,26 +21,87 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import urllib2
+import urlparse
+import httplib
+import socket
+import sys
+import threading
+import traceback
+import Queue
+import sqlite3
+import time
+import re
+import os
+import itertools
 import json
 import csv
 import cStringIO
 import codecs
+import gzip
+import contextlib
+import marshal
+import mmap
+import struct
+import types
+import zlib
+import bisect
+import difflib
+import unicodedata
+import hashlib
+import calendar
+import select
+import errno
 import collections as colls
-from HTMLParser import HTMLParser
+from multiprocessing.pool import ThreadPool
+import htmlentitydefs
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 base = 'http://yourbaseurl.edu'
 port = ':81'
-collections = {}
-
-def item(alias, id, pageinfo='off'):
-    """Factory for creating Item subclass instances."""
+# max idle keep-alive connections kept open per host, and socket timeout in seconds
+poolsize = 10
+timeout = 30
+# default number of concurrent requests for bulk calls (e.g. fetching page metadata)
+maxworkers = 8
+# max number of fields dmQuery returns per call
+maxqueryfields = 5
+# max number of unescaped values memoized by unescape(), 0 to turn off
+unescapecachesize = 10000
+# format version of snapshot files written by savesnapshot()
+snapshotversion = 1
+
+def item(alias, id, pageinfo='off', toplevel=False, find=None, modified=None):
+    """Factory for creating Item subclass instances.
+
+    Pass toplevel=True for ids known to be items rather than pages (e.g. from getItems or
+    dmQuery) to skip the GetParent check, and the item's file name as find (the 'find'
+    field of dmQuery results) to skip dmGetCompoundObjectInfo for single page items, whose
+    file name doesn't end in .cpd. The calls still needed are made at the same time.
+
+    If the item's current dmmodified date is known (e.g. from dmQuery), pass it as modified
+    so that responses a ResponseCache holds for an older version of the item aren't used.
+    Without it, a cached item's dmGetItemInfo is fetched before its other calls, so that a
+    fresh response can drop the item's out of date responses before they are read."""
     call = Api()
-    info = call.dmGetItemInfo(alias, id)
-    objinfo = call.dmGetCompoundObjectInfo(alias, id)
-    parent = call.dmGetParent(alias, id)
+    if modified is not None and call.cache is not None:
+        call.cache.validate([(alias, id, modified)])
+    infofirst = call.cache is not None and modified is None
+    if infofirst:
+        info = call.dmGetItemInfo(alias, id)
+    compound = find is None or find.endswith('.cpd')
+    if compound:
+        objtask = spawn(call.dmGetCompoundObjectInfo, alias, id)
+    if not toplevel:
+        parenttask = spawn(call.dmGetParent, alias, id)
+    if not infofirst:
+        info = call.dmGetItemInfo(alias, id)
     #initialize Collection object for alias and store in collections
-    if alias not in collections:
-        collections[alias] = Collection(alias)
+    collections.load(alias)
+    objinfo = objtask.get() if compound else {'code': '-2'}
+    parent = parenttask.get() if not toplevel else -1
     if ('code' in objinfo):
         if (str(parent) != '-1'):
             raise RuntimeError('ID entered is not an item')
@@ -54,6 +115,190 @@ def item(alias, id, pageinfo='off'):
         else:
             raise RuntimeError('error')
 
+def items(alias, ids, pageinfo='off', workers=None, errors='capture', toplevel=False, finds=None,
+    modified=None):
+    """Generator for creating many Item subclass instances at once.
+
+    ids can be CDM item ids, (alias, id) tuples (as returned by Api.dmQuery) or Records
+    (from Collection.records()). Up to workers items (default maxworkers) are built at a
+    time, and are yielded in the order of ids. With errors='capture', an item that can't
+    be built is yielded as an ItemError so the rest of the harvest carries on;
+    errors='raise' raises it instead.
+
+    toplevel, finds (a dict of file names with item id as key) and modified (a dict of
+    dmmodified dates with item id as key) are passed on to item(). Records are known to be
+    items and carry their file name (and dmmodified, if queried), so they are built with the
+    fewest calls."""
+    #initialize Collection object for alias before items are built in parallel
+    collections.load(alias)
+
+    def build(i):
+        top = toplevel
+        find = date = None
+        if isinstance(i, Record):
+            a, id, find, top = i.alias, i.id, i.find, True
+            date = i.info.get('dmmodified')
+        elif isinstance(i, tuple):
+            a, id = i
+        else:
+            a, id = alias, i
+        if find is None and finds is not None:
+            find = finds.get(id)
+        if date is None and modified is not None:
+            date = modified.get(id)
+        try:
+            # page metadata is fetched within the worker so no more than workers calls run at once
+            obj = item(a, id, toplevel=top, find=find, modified=date)
+            if (pageinfo == 'on'):
+                obj.pageinfo(workers=1)
+            return obj
+        except Exception as e:
+            if errors == 'raise':
+                raise
+            return ItemError(a, id, e, traceback.format_exc())
+
+    return pmap(build, ids, workers)
+
+
+class ItemError:
+    """An item that could not be built by items().
+
+    Attributes:
+        alias       The collection alias
+        id          The CDM generated identifier of the item
+        error       The exception raised while building the item
+        traceback   The formatted traceback of the error
+    """
+    def __init__(self, alias, id, error, traceback):
+        self.alias = alias
+        self.id = id
+        self.error = error
+        self.traceback = traceback
+
+    def __repr__(self):
+        return '<pycdm.ItemError %s/%s: %r>' % (self.alias, self.id, self.error)
+
+def changes(alias, checkpoint):
+    """Compares a collection with a Checkpoint and returns a Changes object.
+
+    Lists the collection's ids and dmmodified dates with dmQuery (one call per 10,000
+    records) instead of fetching any item records."""
+    started = time.strftime('%Y-%m-%d')
+    since = checkpoint.harvested
+    records = {}
+    finds = {}
+    created = []
+    modified = []
+    for page in collections.load(alias).querypages(fields='dmmodified'):
+        for r in page:
+            id = str(r['pointer'])
+            records[id] = r['dmmodified']
+            finds[id] = r.get('find') or None
+            if id not in checkpoint.records:
+                created.append(id)
+            # dmmodified is a date, so items changed again on the day of the last
+            # harvest are picked up by the date as well as by a changed value
+            elif checkpoint.records[id] != records[id] or (since is not None and records[id] >= since):
+                modified.append(id)
+    deleted = [id for id in checkpoint.records if id not in records]
+    return Changes(alias, checkpoint, created, modified, deleted, records, started, finds)
+
+
+class Checkpoint:
+    """The state of a collection at its last harvest, stored in a JSON file.
+
+    Attributes:
+        path        Path of the checkpoint file
+        alias       The collection alias
+        harvested   Date (YYYY-MM-DD) of the last harvest, None if never harvested
+        records     A dict of each harvested item's dmmodified date with item id as key
+    """
+    def __init__(self, path, alias=None):
+        self.path = path
+        self.alias = alias
+        self.harvested = None
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                state = json.load(f)
+            self.alias = state['alias']
+            self.harvested = state['harvested']
+            self.records = state['records']
+
+    def save(self):
+        """Writes the checkpoint file, replacing it only once fully written."""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            json.dump({'alias': self.alias, 'harvested': self.harvested, 'records': self.records}, f)
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+
+
+class Changes:
+    """Items created, modified and deleted in a collection since its Checkpoint.
+
+    Harvest the changed items with items(), then call commit() to move the checkpoint
+    forward. Only items that items() has yielded are moved forward; items that couldn't
+    be built, or weren't reached (the harvest stopped early, or never ran), keep their
+    old checkpoint entry, so they are tried again on the next run.
+
+        checkpoint = pycdm.Checkpoint('leighhunt.json', 'leighhunt')
+        found = pycdm.changes('leighhunt', checkpoint)
+        for i in found.items(pageinfo='on'):
+            ...
+        found.commit()
+
+    Attributes:
+        alias       The collection alias
+        checkpoint  The Checkpoint compared against
+        created     A list of ids of items not in the checkpoint
+        modified    A list of ids of items modified since the checkpoint
+        deleted     A list of ids of checkpoint items no longer in the collection
+        records     A dict of every item's current dmmodified date with item id as key
+        started     Date (YYYY-MM-DD) the collection was listed
+        finds       A dict of every item's file name with item id as key
+        done        A set of ids of the changed items items() has yielded
+    """
+    def __init__(self, alias, checkpoint, created, modified, deleted, records, started, finds=None):
+        self.alias = alias
+        self.checkpoint = checkpoint
+        self.created = created
+        self.modified = modified
+        self.deleted = deleted
+        self.records = records
+        self.started = started
+        self.finds = finds or {}
+        self.done = set()
+
+    def __len__(self):
+        return len(self.created) + len(self.modified) + len(self.deleted)
+
+    def items(self, pageinfo='off', workers=None):
+        """Generator yielding the created and modified items (see items())."""
+        # the ids come from the collection listing, so they are all items
+        for obj in items(self.alias, self.created + self.modified, pageinfo, workers, toplevel=True, finds=self.finds,
+            modified=self.records):
+            if not isinstance(obj, ItemError):
+                self.done.add(obj.id)
+            yield obj
+
+    def commit(self):
+        """Updates the checkpoint to the current state of the collection, for the items
+        harvested so far, and saves it."""
+        records = dict(self.records)
+        for id in self.created + self.modified:
+            if id in self.done:
+                continue
+            if id in self.checkpoint.records:
+                records[id] = self.checkpoint.records[id]
+            else:
+                del records[id]
+        self.checkpoint.alias = self.alias
+        self.checkpoint.records = records
+        self.checkpoint.harvested = self.started
+        self.checkpoint.save()
+
 
 class Collection:
     """A CONTENTdm collection
@@ -64,9 +309,12 @@ class Collection:
         url     The URL for the digital collection
         fields  A dict of the collection's Field objects with field nickname as key
         dcmap   A dict of the collection field mapping to Qualified Dublin Core
-        items   A list of ids for all items in the collection
+        items   A list of ids for all items in the collection (set by getItems())
+
+    Controlled vocabularies are fetched up to workers fields at a time, or with
+    vocab='lazy' only when a field's vocabterms is first read.
     """
-    def __init__(self, alias):
+    def __init__(self, alias, vocab='eager', workers=None):
         call = Api()
         params = call.dmGetCollectionParameters(alias)
         fields = call.dmGetCollectionFields(alias)
@@ -77,8 +325,12 @@ class Collection:
         # fields are structured as a dictionary of objects with nickname as key (nick:Field)
         self.fields = {}
         for f in fields:
-            field = Field(alias, f)
+            field = Field(alias, f, loadvocab=False)
             self.fields[field.nick] = field
+        if vocab == 'eager':
+            vocabfields = [f for f in self.fields.values() if f.vocab == 1]
+            for f in pmap(Field.loadvocab, vocabfields, workers):
+                pass
         self.dcmap = {}
         # map field nicknames to dc nicknames, '' if no map
         for key, value in self.fields.items():
@@ -87,22 +339,150 @@ class Collection:
             else:
                 self.dcmap[key] = value.dc
 
-    def getItems(self, startnum='0', items=[]):
+    def todc(self, info):
+        """Returns a dict of Dublin Core metadata for an info dict, where key=DC field name.
+
+        Values of fields mapped to the same DC field are joined with ';'."""
+        return self.todcbatch((info,))[0]
+
+    def todcbatch(self, infos):
+        """Returns a list of Dublin Core metadata dicts (see todc()) for a sequence of info dicts."""
+        plan = self.dcmap
+        records = []
+        append = records.append
+        for info in infos:
+            dc = {}
+            for key, value in info.iteritems():
+                if key in plan:
+                    dcfield = plan[key]
+                    parts = dc.get(dcfield)
+                    if parts is None:
+                        parts = dc[dcfield] = []
+                    if ';' in value:
+                        parts.extend([v for v in value.split(';') if v])
+                    elif value:
+                        parts.append(value)
+            for dcfield, parts in dc.iteritems():
+                dc[dcfield] = ';'.join(parts)
+            append(dc)
+        return records
+
+    def getItems(self, startnum='1'):
         """Get all item ids in a Collection."""
+        self.items = [i[1] for i in self.iter_items(start=startnum)]
+
+    def iter_items(self, pagesize=10000, start='1', prefetch=True):
+        """Generator yielding (alias, id) for every item in a Collection, in dmrecord order.
+
+        Items are listed with dmQuery, pagesize records per call. With prefetch on, the next
+        page is fetched in the background while the current one is consumed; with it off,
+        items are yielded one at a time as each response arrives."""
+        for records in self.querypages(pagesize=pagesize, start=start, prefetch=prefetch, stream=not prefetch):
+            for r in records:
+                yield (self.alias, str(r['pointer']))
+
+    def records(self, fields, pagesize=10000, start='1', prefetch=True):
+        """Generator yielding a Record for every item in a Collection, with just the given fields.
+
+        fields is a list of field nicknames. Records come from dmQuery, pagesize items per call
+        (and one call per maxqueryfields fields), rather than a dmGetItemInfo call per item."""
+        if isinstance(fields, basestring):
+            fields = fields.split('!')
+        unknown = [f for f in fields if f not in self.fields]
+        if unknown:
+            raise RuntimeError('Not a field in ' + self.alias + ': ' + ', '.join(unknown))
+        groups = [fields[i:i + maxqueryfields] for i in range(0, len(fields), maxqueryfields)] or [[]]
+        # each group of fields is queried with the same sort and paging, so pages line up unless
+        # items are added or deleted between the queries, in which case rows are not matched up
+        pagesets = [self.querypages(fields='!'.join(g), pagesize=pagesize, start=start, prefetch=prefetch)
+            for g in groups]
+        changed = RuntimeError('Items in ' + self.alias + ' changed while their fields were queried')
+        for pages in itertools.izip_longest(*pagesets):
+            if None in pages:
+                raise changed
+            others = [dict((r['pointer'], r) for r in page) for page in pages[1:]]
+            if any(len(rows) != len(pages[0]) for rows in others):
+                raise changed
+            records = []
+            for first in pages[0]:
+                parts = [first]
+                for rows in others:
+                    r = rows.get(first['pointer'])
+                    if r is None:
+                        raise changed
+                    parts.append(r)
+                info = {}
+                for r, group in zip(parts, groups):
+                    for f in group:
+                        info[f] = r.get(f, '')
+                records.append(Record(self.alias, str(parts[0]['pointer']), parts[0].get('find', ''),
+                    htmlunescape(info)))
+            for record, dc in zip(records, self.todcbatch([r.info for r in records])):
+                record.dcinfo = dc
+                yield record
+
+    def querypages(self, fields='dmmodified', pagesize=10000, start='1', prefetch=True, stream=False):
+        """Generator yielding the records of a Collection one dmQuery page (a list of records) at a time.
+
+        fields is a '!'-separated list of field nicknames to include in records. The default,
+        dmmodified, also lets a ResponseCache drop cached items that have changed. Records are
+        decoded from the response as it arrives; with stream on (and prefetch off) each page
+        is yielded as a QueryStream to be iterated while it downloads, instead of a list."""
         call = Api()
-        items = items
-        itemscount = 0
-        alias = self.alias
-        itemsQuery = call.dmQuery('0', alias=alias, sortby='dmrecord', maxrecs='10000', start=startnum)
-        itemscount = len(itemsQuery)
-        for i in itemsQuery:
-            items.append(i[1])
-        if itemscount == 10000:
-            startnum = str(itemscount + 1)
-            self.getItems(startnum=startnum, items=items)
-        self.items = items
-
-class Field:
+        def query(start):
+            return call.dmQuery('0', alias=self.alias, fields=fields, sortby='dmrecord', maxrecs=str(pagesize),
+                start=str(start), ret='records')
+        def fetch(start):
+            records = query(start)
+            return list(records), records.pager
+        start = int(start)
+        if stream and not prefetch:
+            while True:
+                records = query(start)
+                yield records
+                # each page must be read through before the next is asked for
+                start += records.count
+                if records.count < int(pagesize) or start > int(records.pager['total']):
+                    return
+        records, pager = fetch(start)
+        while True:
+            start += len(records)
+            more = len(records) == int(pagesize) and start <= int(pager['total'])
+            if more and prefetch:
+                nextpage = spawn(fetch, start)
+            if records:
+                yield records
+            if not more:
+                break
+            if prefetch:
+                records, pager = nextpage.get()
+            else:
+                records, pager = fetch(start)
+
+class Record(object):
+    """An item's metadata for a chosen set of fields, from Collection.records().
+
+    Attributes:
+        alias   The collection alias
+        id      The CDM generated identifer of the item
+        find    The filename of the item's file (.cpd for compound objects)
+        info    Dict of the chosen fields' metadata, where key=field nickname
+        dcinfo  Dict of the chosen fields' metadata, where key=DC field name
+    """
+    __slots__ = ('alias', 'id', 'find', 'info', 'dcinfo')
+
+    def __init__(self, alias, id, find, info, dcinfo=None):
+        self.alias = alias
+        self.id = id
+        self.find = find
+        self.info = info
+        self.dcinfo = dcinfo
+
+    def __repr__(self):
+        return '<pycdm.Record %s/%s>' % (self.alias, self.id)
+
+
+class Field(object):
     """A Collection field
 
     Attributes:
@@ -114,9 +494,10 @@ class Field:
         hide    Field is hidden, hidden=1
         search  Field is indexed, search=1
         vocab   Field has controlled vocabulary, vocab=1
-        vocabterms  List of controlled vocabulary terms
+        vocabterms  List of controlled vocabulary terms (fetched when first read if the
+                    field was created with loadvocab=False)
     """
-    def __init__(self, alias, fieldinfo):
+    def __init__(self, alias, fieldinfo, loadvocab=True):
         self.alias = alias
         self.name = fieldinfo['name']
         self.nick = fieldinfo['nick']
@@ -125,35 +506,245 @@ class Field:
         self.hide = fieldinfo['hide']
         self.search = fieldinfo['search']
         self.vocab = fieldinfo['vocab']
+        self._vocabterms = None
+        self.vocabloaded = self.vocab != 1
+        if loadvocab:
+            self.loadvocab()
+
+    @property
+    def vocabterms(self):
+        if not self.vocabloaded:
+            self.loadvocab()
+        return self._vocabterms
+
+    @vocabterms.setter
+    def vocabterms(self, value):
+        self._vocabterms = value
+        self.vocabloaded = True
+
+    def loadvocab(self):
+        """Calls dmGetCollectionFieldVocabulary to get the field's controlled vocabulary terms."""
         if self.vocab == 1:
             call = Api()
-            terms = call.dmGetCollectionFieldVocabulary(alias, self.nick)
+            terms = call.dmGetCollectionFieldVocabulary(self.alias, self.nick)
             if len(terms) >= 1:
-                self.vocabterms = htmlunescape(terms)
+                self._vocabterms = htmlunescape(terms)
             else:
-                self.vocabterms = None
-        else:
-            self.vocabterms = None
+                self._vocabterms = None
+        self.vocabloaded = True
+
+
+class CollectionRegistry:
+    """A thread-safe store of Collection objects, with collection alias as key.
+
+    Works like a dict, but holds at most maxsize collections (dropping the least
+    recently used) and treats collections older than ttl seconds as missing, so they
+    are fetched again. Use load() to get a Collection, creating it if needed: when
+    several threads load the same new alias at once, the Collection is built once and
+    shared.
+
+    Attributes:
+        maxsize     Max number of collections kept
+        ttl         Seconds a collection is kept before it is fetched again (None to keep)
+    """
+    def __init__(self, maxsize=100, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = colls.OrderedDict()
+        self.building = {}
+        self.lock = threading.RLock()
+
+    def fresh(self, alias):
+        """Returns the stored Collection for alias if it hasn't expired, marking it recently used."""
+        entry = self.entries.pop(alias, None)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry[1] > self.ttl:
+            return None
+        self.entries[alias] = entry
+        return entry[0]
+
+    def load(self, alias, **kwds):
+        """Returns the Collection for alias, building and storing it if missing or expired.
+
+        Keywords are passed on to Collection() when it is built."""
+        with self.lock:
+            collection = self.fresh(alias)
+            if collection is not None:
+                return collection
+            event = self.building.get(alias)
+            builder = event is None
+            if builder:
+                event = self.building[alias] = threading.Event()
+        if not builder:
+            # another thread is building this collection; wait and share it
+            event.wait()
+            with self.lock:
+                if alias in self.entries:
+                    return self.entries[alias][0]
+            return self.load(alias, **kwds)
+        try:
+            collection = Collection(alias, **kwds)
+            self[alias] = collection
+        finally:
+            with self.lock:
+                del self.building[alias]
+            event.set()
+        return collection
+
+    def invalidate(self, alias=None):
+        """Drops the stored Collection for alias (or all collections), to be fetched again on next use."""
+        with self.lock:
+            if alias is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(alias, None)
+
+    def __contains__(self, alias):
+        with self.lock:
+            entry = self.entries.get(alias)
+            return entry is not None and (self.ttl is None or time.time() - entry[1] <= self.ttl)
+
+    def __getitem__(self, alias):
+        with self.lock:
+            collection = self.fresh(alias)
+            if collection is None:
+                raise KeyError(alias)
+            return collection
+
+    def __setitem__(self, alias, collection):
+        with self.lock:
+            self.entries.pop(alias, None)
+            self.entries[alias] = (collection, time.time())
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __delitem__(self, alias):
+        with self.lock:
+            del self.entries[alias]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, alias, default=None):
+        if alias in self:
+            return self[alias]
+        return default
+
+    def keys(self):
+        with self.lock:
+            return self.entries.keys()
+
+    def values(self):
+        with self.lock:
+            return [e[0] for e in self.entries.values()]
+
+    def items(self):
+        with self.lock:
+            return [(k, e[0]) for k, e in self.entries.items()]
+
+    def clear(self):
+        self.invalidate()
+
+collections = CollectionRegistry()
+
+def loadcollections(aliases, workers=None, vocab='eager'):
+    """Creates the Collection objects for many aliases at once and stores them in collections.
+
+    Up to workers collections (default maxworkers) are built at a time, each fetching its
+    vocabularies one by one (or when first read, with vocab='lazy'). Returns a dict of
+    Collection objects with alias as key."""
+    aliases = list(aliases)
+    def build(alias):
+        return collections.load(alias, vocab=vocab, workers=1)
+    return dict(zip(aliases, pmap(build, aliases, workers)))
 
 
 class Item:
     """Abstract superclass for items"""
+    pageids = None
+    pagefiles = None
+
     def __init__(self, alias, id, info):
         pass
 
     def pages(self):
         pass
-    def pageinfo(self):
-        """Get page metadata (dmGetItemInfo) for all pages in an Item."""
-        for p in self.pages:
-            p.pageinfo()
 
+    def page(self, id):
+        """Returns the item's Page with CDM id (pageptr) id, or None."""
+        if self.pageids is None:
+            self.pageids = dict((p.id, p) for p in self.pages)
+        return self.pageids.get(str(id))
+
+    def filepage(self, file):
+        """Returns the item's Page with file name file, or None."""
+        if self.pagefiles is None:
+            self.pagefiles = dict((p.file, p) for p in self.pages)
+        return self.pagefiles.get(file)
+
+    def pageinfo(self, workers=None):
+        """Get page metadata (dmGetItemInfo) for all pages in an Item, up to workers pages at a time."""
+        pages = [p for p in self.pages if isinstance(p, Page)]
+        for p in pmap(Page.pageinfo, pages, workers):
+            pass
+
+
+class Singlepage(object):
+    """Abstract superclass for single page objects.
+
+    refurl, fileurl, imageurl and thumburl are built the first time they are read and
+    kept, so no calls are made (e.g. dmGetItemUrl for .url files) until they are needed."""
+    __slots__ = ()
 
-class Singlepage:
-    """Abstract superclass for single page objects."""
     def __init__(self):
         pass
-    
+
+    @property
+    def refurl(self):
+        if self._refurl is None:
+            refurlparts = [base, 'cdm', 'ref', 'collection', self.alias, 'id', self.id]
+            self._refurl = '/'.join(refurlparts)
+        return self._refurl
+
+    @refurl.setter
+    def refurl(self, value):
+        self._refurl = value
+
+    @property
+    def fileurl(self):
+        if self._fileurl is None:
+            self._fileurl = self.getfileurl(self.alias, self.file)
+        return self._fileurl
+
+    @fileurl.setter
+    def fileurl(self, value):
+        self._fileurl = value
+
+    @property
+    def imageurl(self):
+        if self._imageurl is None:
+            self._imageurl = Api().GetImage(self.alias, self.id)
+        return self._imageurl
+
+    @imageurl.setter
+    def imageurl(self, value):
+        self._imageurl = value
+
+    @property
+    def thumburl(self):
+        if self._thumburl is None:
+            thumburlparts = [base, 'utils/getthumbnail/collection', self.alias, 'id', self.id]
+            self._thumburl = '/'.join(thumburlparts)
+        return self._thumburl
+
+    @thumburl.setter
+    def thumburl(self, value):
+        self._thumburl = value
+
     def getfileurl(self, alias, find):
         """Calls dmGetItemUrl to get resource url for .url files"""
         call = Api()
@@ -177,8 +768,10 @@ class Singlepage:
 
 
 # abstract class Subitem
-class Subitem:
+class Subitem(object):
     """Abstract superclass for constituent parts of items."""
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -205,23 +798,17 @@ class SinglePageItem(Item, Singlepage):
     def __init__(self, alias, id, info, pageinfo):
         self.alias = alias
         self.id = id
-        #If not in collections dict, initialize Collection object for alias and store in collections
-        if alias in collections:
-            self.collection = collections[alias]
-        else:
-            collections[alias] = Collection(alias)
-            self.collection = collections[alias]
+        #If not in collections, initialize Collection object for alias and store in collections
+        self.collection = collections.load(alias)
         self.info = htmlunescape(info)
         self.dcinfo = dcinfo(alias, self.info)
-        self.label = HTMLParser().unescape(info['title'])
+        self.label = self.info['title']
         self.file = info['find']
         self.parentnodetitle = ''
-        refurlparts = [base, 'cdm', 'ref', 'collection', alias, 'id', self.id]
-        self.refurl = '/'.join(refurlparts)
-        self.fileurl = self.getfileurl(alias, info['find'])
-        self.imageurl = self.GetImage()
-        thumburlparts = [base, 'utils/getthumbnail/collection', self.alias, 'id', self.id]
-        self.thumburl = '/'.join(thumburlparts)
+        self._refurl = None
+        self._fileurl = None
+        self._imageurl = None
+        self._thumburl = None
         self.pages = self.getPages()
     def getPages(self):
         """Return a list of page objects."""
@@ -250,25 +837,14 @@ class Document(Item):
         self.id = id
         self.info = htmlunescape(info)
         self.dcinfo = dcinfo(alias, self.info)
-        #If not in collections dict, initialize Collection object for alias and store in collections
-        if alias in collections:
-            self.collection = collections[alias]
-        else:
-            collections[alias] = Collection(alias)
+        #If not in collections, initialize Collection object for alias and store in collections
+        self.collection = collections.load(alias)
         refurlparts = [base, 'cdm', 'ref', 'collection', alias, 'id', self.id]
         self.refurl = '/'.join(refurlparts)
-        self.structure = []
-        for key, value in objinfo.items():
-            if key == 'page':
-                if type(value) == list:
-                    for v in value:
-                        page = Page(v, alias, self.id, self.info['title'], pageinfo)
-                        self.structure.append(page)
-                else:
-                    page = Page(value, alias, self.id, self.info['title'], pageinfo)
-                    self.structure.append(page)
-
+        self.structure = compoundstructure(objinfo, alias, self.id, self.info['title'])[0]
         self.pages = self.getPages()
+        if (pageinfo == 'on'):
+            self.pageinfo()
     def getPages(self):
         """Return a list of constituent page objects."""
         return self.structure
@@ -292,41 +868,27 @@ class Monograph(Item):
     def __init__(self, alias, id, info, objinfo, pageinfo):
         self.alias = alias
         self.id = id
-        #If not in collections dict, initialize Collection object for alias and store in collections
-        if alias in collections:
-            self.collection = collections[alias]
-        else:
-            collections[alias] = Collection(alias)
+        #If not in collections, initialize Collection object for alias and store in collections
+        self.collection = collections.load(alias)
         self.info = htmlunescape(info)
         self.dcinfo = dcinfo(alias, self.info)
         refurlparts = [base, 'cdm', 'ref', 'collection', alias, 'id', self.id]
         self.refurl = '/'.join(refurlparts)
-        self.structure = []
-        for key, value in objinfo.items():
-            if key == 'node':
-                subitem = Node(colls.OrderedDict(value), alias, self.id, pageinfo, self.info['title'])
-                self.structure.append(subitem)
-            elif key == 'page':
-                subitem = Page(value, alias, self.id, pageinfo)
-                self.structure.append(subitem)
+        self.structure, self.allpages = compoundstructure(objinfo, alias, self.id, self.info['title'])
         self.pages = self.getPages()
+        if (pageinfo == 'on'):
+            self.pageinfo()
     def getPages(self):
         """Return a list of constituent page objects."""
-        pages = []
-        for s in self.structure:
-            if isinstance(s, Page):
-                pages.append(s)
-            elif isinstance(s, Node):
-                nodepages = s.getPages()
-                pages.extend(nodepages)
-            else:
-                print 'none'
-        return pages
+        return self.allpages
 
 
 class Node(Subitem):
     """Subitem subclass for aggregations of other Nodes and/or Pages.
 
+    A Node's pages are a slice (allpages[start:end]) of the flat list of every page in its
+    item, made the first time .pages is read.
+
         Attributes:
         alias       The collection alias
         structure   The node/page structure of the node
@@ -334,42 +896,34 @@ class Node(Subitem):
         parentnodetitle     The title of the parent node
         parentId    The CDM generated identifier of the parent item
         pages       List of the node's consitutent page objects
+        allpages    List of all page objects of the item (or top node) the node is part of
+        start       Offset of the node's first page in allpages
+        end         Offset just past the node's last page in allpages
         """
-    def __init__(self, nodeinfo, alias, parentId, pageinfo, parenttitle):
+    __slots__ = ('alias', 'structure', 'parentId', 'nodetitle', 'parentnodetitle', 'allpages', 'start', 'end',
+        '_pages')
+
+    def __init__(self, nodeinfo, alias, parentId, pageinfo, parenttitle, parse=True):
         self.alias = alias
         self.structure = []
         self.parentId = parentId
-        self.nodetitle = HTMLParser().unescape(nodeinfo['nodetitle'])
+        self.nodetitle = unescape(nodeinfo['nodetitle'])
         self.parentnodetitle = parenttitle
-        for key, value in nodeinfo.items():
-            if (key == 'page'):
-                if type(value) == list:
-                    for item in value:
-                        subitem = Page(item, alias, parentId, self.nodetitle, pageinfo)
-                        self.structure.append(subitem)
-                else:
-                    subitem = Page(value, alias, parentId, self.nodetitle, pageinfo)
-                    self.structure.append(subitem)
-            elif (key == 'node'):
-                if type(value) == list:
-                    for item in value:
-                        subitem = Node(item, alias, parentId, pageinfo, self.nodetitle)
-                        self.structure.append(subitem)
-                else:
-                    subitem = Node(value, alias, parentId, pageinfo, self.nodetitle)
-                    self.structure.append(subitem)
-        self.pages = self.getPages()
+        self._pages = None
+        if parse:
+            self.structure, self.allpages = compoundstructure(nodeinfo, alias, parentId, self.nodetitle, pageinfo)
+            self.start = 0
+            self.end = len(self.allpages)
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = self.allpages[self.start:self.end]
+        return self._pages
 
     def getPages(self):
         """Returns a list of Page objects composing the Node."""
-        pages = []
-        for s in self.structure:
-            if isinstance(s, Page):
-                pages.append(s)
-            elif isinstance(s, Node):
-                nodepages = s.getPages()
-                pages.extend(nodepages)
-        return pages
+        return self.pages
 
 
 class Page(Subitem, Singlepage):
@@ -394,20 +948,20 @@ class Page(Subitem, Singlepage):
                     set URL with different parameters 
         thumburl    URL for the page thumbnail
     """
+    __slots__ = ('alias', 'id', 'label', 'file', 'parentnodetitle', 'parentId', 'info', 'dcinfo',
+        '_refurl', '_fileurl', '_imageurl', '_thumburl')
+
     def __init__(self, objinfo, alias, parentId, parentnodetitle, pageinfo='off'):
         self.alias = alias
         self.id = objinfo['pageptr']
-        self.label = HTMLParser().unescape(objinfo['pagetitle'])
+        self.label = unescape(objinfo['pagetitle'])
         self.file = objinfo['pagefile']
-        self.fileurl = self.getfileurl(alias, objinfo['pagefile'])
         self.parentnodetitle = parentnodetitle
         self.parentId = parentId
-        refurlparts = [base, 'cdm', 'ref', 'collection', alias, 'id', self.id]
-        self.refurl = '/'.join(refurlparts)
-        call = Api()
-        self.imageurl = call.GetImage(self.alias, self.id)
-        thumburlparts = [base, 'utils/getthumbnail/collection', self.alias, 'id', self.id]
-        self.thumburl = '/'.join(thumburlparts)
+        self._refurl = None
+        self._fileurl = None
+        self._imageurl = None
+        self._thumburl = None
         if (pageinfo == 'on'):
             self.pageinfo()
 
@@ -417,37 +971,1117 @@ class Page(Subitem, Singlepage):
         self.info = htmlunescape(call.dmGetItemInfo(self.alias, self.id))
         self.dcinfo = dcinfo(self.alias, self.info)
 
+def compoundstructure(objinfo, alias, parentId, title, pageinfo='off'):
+    """Builds the Nodes and Pages of a dmGetCompoundObjectInfo response (or of one of its nodes).
+
+    Returns (structure, pages): the list of top level Nodes and Pages, and a flat list of
+    every Page in order. The tree is walked with a stack rather than recursion, so any
+    depth is fine, and each Node just records where its pages start and end in the flat
+    list instead of copying them."""
+    pages = []
+    structure = []
+    # each entry: the list being filled, an iterator over the entries still to add to it,
+    # the Node it belongs to (None at the top) and the title given to its pages
+    stack = [(structure, compoundentries(objinfo), None, title)]
+    while stack:
+        children, entries, node, nodetitle = stack[-1]
+        for key, value in entries:
+            if key == 'page':
+                page = Page(value, alias, parentId, nodetitle, pageinfo)
+                pages.append(page)
+                children.append(page)
+            else:
+                child = Node(value, alias, parentId, pageinfo, nodetitle, parse=False)
+                child.allpages = pages
+                child.start = len(pages)
+                children.append(child)
+                stack.append((child.structure, compoundentries(value), child, child.nodetitle))
+                break
+        else:
+            stack.pop()
+            if node is not None:
+                node.end = len(pages)
+    return structure, pages
+
+def compoundentries(info):
+    """Yields ('page', pageinfo) and ('node', nodeinfo) for each page and node directly in a
+    compound object or node, in order, whether the response gave them as a list or singly."""
+    for key, value in info.items():
+        if key in ('page', 'node'):
+            if type(value) != list:
+                value = [value]
+            for v in value:
+                yield key, v
+
 def dcinfo(alias, info):
     """Function for generating Dublin Core metadata."""
-    dc = {}
-    for key, value in info.items():
-        if key in collections[alias].dcmap.keys():
-            dcfield = collections[alias].dcmap[key]
-            if dcfield not in dc.keys():
-                dc[dcfield] = []
-            for v in value.split(';'):
-                if (v != '') and (v != ';'):
-                    dc[dcfield].append(v.strip(';'))
-    for key, value in dc.items():
-        if len(value) > 1:
-            dc[key] = ';'.join(value)
-        elif len(value) == 1:
-            dc[key] = value[0]
-        else:
-            dc[key] = ''
-    return dc
+    return collections.load(alias).todc(info)
+
+def dcinfos(alias, infos):
+    """Function for generating Dublin Core metadata for many info dicts at once. Returns a list."""
+    return collections.load(alias).todcbatch(infos)
+
+def pmap(func, iterable, workers=None):
+    """Maps func over iterable on a pool of threads, yielding results in order.
+
+    Runs up to workers calls at once (default maxworkers) and reads iterable lazily,
+    so long inputs never have more than a few calls per worker queued."""
+    workers = workers or maxworkers
+    if workers <= 1:
+        for i in iterable:
+            yield func(i)
+        return
+    tasks = Queue.Queue()
+    pending = colls.deque()
+    threads = []
+    try:
+        for i in iterable:
+            task = Task(func, (i,))
+            pending.append(task)
+            tasks.put(task)
+            if len(threads) < workers:
+                threads.append(spawn(runtasks, tasks))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        # skip calls still queued if the caller stopped early, then stop the threads
+        for task in pending:
+            task.cancelled = True
+        for t in threads:
+            tasks.put(None)
+
+def runtasks(tasks):
+    """Runs Tasks from a queue until it gets None."""
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        if not task.cancelled:
+            task.run()
+
+def spawn(func, *args):
+    """Calls func(*args) on a new daemon thread and returns its Task."""
+    task = Task(func, args)
+    thread = threading.Thread(target=task.run)
+    thread.daemon = True
+    thread.start()
+    return task
+
+
+class Task:
+    """A function call run on another thread.
+
+    Attributes:
+        func        The function to call
+        args        A tuple of arguments for func
+        cancelled   True if the call should be skipped
+    """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.waiters = []
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except:
+            self.error = sys.exc_info()
+        with self.lock:
+            self.done.set()
+            waiters = self.waiters
+        for fd in waiters:
+            try:
+                os.write(fd, '.')
+            except OSError:
+                # the pipe is full, so its reader is already due to wake
+                pass
+
+    def get(self):
+        """Waits for the call to finish and returns its value, or raises its error."""
+        if not self.done.is_set():
+            if fcntl is not None and threading.current_thread().name == 'MainThread':
+                self.waitmain()
+            else:
+                self.done.wait()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+    def waitmain(self):
+        # a blocking lock wait can't be interrupted by Ctrl-C in Python 2, but select() can,
+        # so the main thread sleeps on a pipe that run() writes to when the call finishes
+        r, w = mainwakeup()
+        with self.lock:
+            if self.done.is_set():
+                return
+            self.waiters.append(w)
+        while not self.done.is_set():
+            try:
+                select.select([r], [], [])
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            # may hold wake-ups left by other Tasks, hence the check of done
+            os.read(r, 4096)
+
+# (process id, read fd, write fd) of the pipe Task.get() waits on in the main thread
+wakeup = None
+
+def mainwakeup():
+    """Returns the read and write fds of the main thread's Task wake-up pipe, made once per process."""
+    global wakeup
+    if wakeup is None or wakeup[0] != os.getpid():
+        r, w = os.pipe()
+        fcntl.fcntl(w, fcntl.F_SETFL, fcntl.fcntl(w, fcntl.F_GETFL) | os.O_NONBLOCK)
+        wakeup = (os.getpid(), r, w)
+    return wakeup[1], wakeup[2]
 
 def htmlunescape(obj):
-    """Unescapes html entities in lists and dict values."""
+    """Unescapes html entities in lists and dict values. Returns a new list or dict."""
     if isinstance(obj, dict):
+        newdict = obj.copy()
         for key, value in obj.iteritems():
-            obj[key] = HTMLParser().unescape(value)
-        return obj
+            newdict[key] = unescape(value)
+        return newdict
     if isinstance(obj, list):
-        newlist = []
-        for o in obj:
-            newlist.append(HTMLParser().unescape(o))
-        return newlist
+        return [unescape(o) for o in obj]
+
+# html entity names and their characters (HTMLParser also accepts &apos;)
+entitydefs = dict((k, unichr(v)) for k, v in htmlentitydefs.name2codepoint.iteritems())
+entitydefs['apos'] = u"'"
+entitypattern = re.compile(r"&(#?[xX]?(?:[0-9a-fA-F]+|\w{1,8}));")
+unescapecache = {}
+
+def unescape(s):
+    """Unescapes html entities in a string, with the same results as HTMLParser().unescape.
+
+    Strings without '&' are returned untouched. Unescaped values are memoized (up to
+    unescapecachesize of them) since vocabulary terms and rights statements repeat."""
+    if '&' not in s:
+        return s
+    try:
+        return unescapecache[s]
+    except KeyError:
+        pass
+    value = entitypattern.sub(replaceentity, s)
+    if unescapecachesize > 0:
+        if len(unescapecache) >= unescapecachesize:
+            unescapecache.clear()
+        unescapecache[s] = value
+    return value
+
+def replaceentity(match):
+    """Returns the character for an entitypattern match, or the entity itself if unknown."""
+    s = match.group(1)
+    try:
+        if s[0] == '#':
+            s = s[1:]
+            if s[0] in ('x', 'X'):
+                c = int(s[1:], 16)
+            else:
+                c = int(s)
+            return unichr(c)
+    except ValueError:
+        return '&#' + s + ';'
+    else:
+        try:
+            return entitydefs[s]
+        except KeyError:
+            return '&' + s + ';'
+
+class ConnectionPool:
+    """Transport that reuses persistent keep-alive HTTP connections, pooled per host.
+
+    Connections are checked out for the length of a request and returned to the
+    pool once the response has been read, so sequential and threaded Api calls to
+    the same CONTENTdm server skip the TCP/TLS handshake.
+
+    Attributes:
+        poolsize    Max number of idle connections kept open per host
+        timeout     Socket timeout in seconds
+        redirects   Max number of redirects to follow for a request
+        pools       A dict of idle connection queues with (scheme, host) as key
+    """
+    def __init__(self, poolsize=poolsize, timeout=timeout, redirects=5):
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.redirects = redirects
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def getconn(self, key):
+        """Returns an idle connection for (scheme, host), or a new one if none are idle."""
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = Queue.LifoQueue(self.poolsize)
+            pool = self.pools[key]
+        try:
+            return pool.get_nowait()
+        except Queue.Empty:
+            scheme, host = key
+            if scheme == 'https':
+                return httplib.HTTPSConnection(host, timeout=self.timeout)
+            return httplib.HTTPConnection(host, timeout=self.timeout)
+
+    def putconn(self, key, conn):
+        """Returns a connection to the pool, closing it if the pool is full."""
+        try:
+            self.pools[key].put_nowait(conn)
+        except Queue.Full:
+            conn.close()
+
+    def urlopen(self, url, headers=None, method='GET'):
+        """Sends a request and returns a PooledResponse.
+
+        Raises urllib2.HTTPError for 4xx/5xx responses, like urllib2.urlopen."""
+        for i in range(self.redirects + 1):
+            parts = urlparse.urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            # a pooled connection may have been dropped by the server while idle,
+            # so retry once on a fresh connection before giving up
+            for attempt in (0, 1):
+                conn = self.getconn(key)
+                reused = conn.sock is not None
+                try:
+                    conn.request(method, path, headers=headers or {})
+                    resp = conn.getresponse()
+                except (httplib.HTTPException, socket.error) as e:
+                    conn.close()
+                    if reused and attempt == 0 and self.dropped(e):
+                        continue
+                    raise
+                break
+            response = PooledResponse(self, key, conn, resp, url)
+            if resp.status in (301, 302, 303, 307) and resp.getheader('location'):
+                response.read()
+                url = urlparse.urljoin(url, resp.getheader('location'))
+                continue
+            if resp.status >= 400:
+                body = response.read()
+                raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg, cStringIO.StringIO(body))
+            return response
+        raise urllib2.HTTPError(url, resp.status, 'Too many redirects', resp.msg, None)
+
+    def dropped(self, error):
+        """Returns whether an error on a reused connection shows the server had closed it, so
+        the request can't have been handled. Other errors, like timeouts, aren't retried."""
+        if isinstance(error, httplib.BadStatusLine):
+            return True
+        return (isinstance(error, socket.error) and not isinstance(error, socket.timeout) and
+            error.errno in (errno.ECONNRESET, errno.EPIPE))
+
+    def close(self):
+        """Closes all idle connections."""
+        with self.lock:
+            pools = self.pools.values()
+            self.pools = {}
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except Queue.Empty:
+                    break
+
+
+class PooledResponse:
+    """A file-like response that returns its connection to the ConnectionPool when fully read.
+
+    Attributes:
+        url     The URL of the request
+        status  The HTTP status code of the response
+    """
+    def __init__(self, pool, key, conn, resp, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.resp = resp
+        self.url = url
+        self.status = resp.status
+
+    def read(self, amt=None):
+        data = self.resp.read(amt)
+        if self.resp.isclosed():
+            self.release()
+        return data
+
+    def getheader(self, name, default=None):
+        return self.resp.getheader(name, default)
+
+    def info(self):
+        return self.resp.msg
+
+    def release(self):
+        if self.conn is not None:
+            self.pool.putconn(self.key, self.conn)
+            self.conn = None
+
+    def close(self):
+        """Closes the response, discarding the connection if the body was not fully read."""
+        if self.conn is not None:
+            if self.resp.isclosed():
+                self.release()
+            else:
+                self.resp.close()
+                self.conn.close()
+                self.conn = None
+
+
+class UrllibTransport:
+    """Transport that opens a new urllib2 connection for every request.
+
+    Use in place of the ConnectionPool where urllib2 handlers (e.g. proxies) are needed."""
+    def urlopen(self, url, headers=None, method='GET'):
+        request = urllib2.Request(url, headers=headers or {})
+        request.get_method = lambda: method
+        return urllib2.urlopen(request)
+
+    def close(self):
+        pass
+
+
+class CacheMiss(RuntimeError):
+    """Raised for a request that is not in the ResponseCache while it is offline."""
+    pass
+
+
+class ResponseCache:
+    """A persistent SQLite cache of dmwebservices responses, keyed by request URL.
+
+    Item responses (dmGetItemInfo, dmGetCompoundObjectInfo, GetParent) are stored with
+    the item's dmmodified value, as last reported by a fresh dmGetItemInfo, by dmQuery
+    results that include the dmmodified field, or by item(..., modified=). Whenever the
+    server reports a different dmmodified for an item, all of that item's cached responses
+    are dropped. Responses stored before any dmmodified was known for the item are kept
+    only if they were fetched on or after the second day after it (dmmodified is a date,
+    so this is the first day sure to have begun after it in every time zone).
+
+    Without a dmmodified to check against, item responses are served until their ttl runs
+    out, so pass it to item() or items() (or harvest with changes()) where it is known.
+
+    Attributes:
+        path        Path of the SQLite database file
+        ttls        Dict of seconds to keep responses, with dmwebservices function as key and
+                    'default' for other functions. 0 disables caching, None never expires.
+        maxsize     Max total bytes of cached responses. Least recently used responses are
+                    evicted past it.
+        offline     If True, requests are only answered from the cache (including expired
+                    responses) and anything else raises CacheMiss
+        touch       Seconds a response's last access time may lag behind, so that cache
+                    hits don't each write to the database
+    """
+    ttls = {
+        'default': 86400,
+        'dmGetItemInfo': 30 * 86400,
+        'dmGetCompoundObjectInfo': 30 * 86400,
+        'GetParent': 30 * 86400,
+        'dmGetItemUrl': 30 * 86400,
+        'dmQuery': 0,
+    }
+    itemfunctions = ('dmGetItemInfo', 'dmGetCompoundObjectInfo', 'GetParent')
+    touch = 3600
+
+    def __init__(self, path, ttls=None, maxsize=1024 * 1024 * 1024, offline=False):
+        self.path = path
+        self.ttls = dict(ResponseCache.ttls)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.maxsize = maxsize
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.text_factory = str
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, function TEXT, alias TEXT, '
+            'id TEXT, modified TEXT, body BLOB, size INTEGER, fetched REAL, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_item ON responses (alias, id)')
+        # the last dmmodified seen for each item, kept when its responses are evicted or not cached
+        self.db.execute('CREATE TABLE IF NOT EXISTS items (alias TEXT, id TEXT, modified TEXT, '
+            'PRIMARY KEY (alias, id))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def ttl(self, function):
+        return self.ttls.get(function, self.ttls['default'])
+
+    def get(self, url):
+        """Returns the cached response body for url, or None if missing or expired."""
+        function, args = splitcall(url)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT body, fetched, accessed FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            ttl = self.ttl(function)
+            if not self.offline and ttl is not None and now - row[1] > ttl:
+                return None
+            # eviction only needs a rough order, so most hits are served without a write
+            if now - row[2] > self.touch:
+                self.db.execute('UPDATE responses SET accessed = ? WHERE url = ?', (now, url))
+        return str(row[0])
+
+    def put(self, url, body):
+        """Stores a response body for url."""
+        function, args = splitcall(url)
+        alias = id = modified = None
+        if args:
+            alias = args[0]
+        if function in self.itemfunctions and len(args) >= 2:
+            id = args[1]
+        if function == 'dmGetItemInfo':
+            # checked even if dmGetItemInfo isn't cached, for the item's other responses
+            match = re.search(r'"dmmodified"\s*:\s*"([^"]*)"', body)
+            if match:
+                self.validate([(alias, id, match.group(1))])
+        if self.ttl(function) == 0:
+            return
+        now = time.time()
+        with self.lock:
+            if id is not None:
+                row = self.db.execute('SELECT modified FROM items WHERE alias = ? AND id = ?', (alias, id)).fetchone()
+                if row is not None:
+                    modified = row[0]
+            old = self.db.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, function, alias, id, modified, sqlite3.Binary(body), len(body), now, now))
+            self.size += len(body) - (old[0] if old else 0)
+            if self.size > self.maxsize:
+                self.evict()
+
+    def evict(self):
+        """Drops least recently used responses until the cache is under 90% of maxsize."""
+        target = self.maxsize * 0.9
+        rows = self.db.execute('SELECT url, size FROM responses ORDER BY accessed')
+        drop = []
+        for url, size in rows:
+            if self.size <= target:
+                break
+            drop.append((url,))
+            self.size -= size
+        self.db.executemany('DELETE FROM responses WHERE url = ?', drop)
+
+    def validate(self, records):
+        """Drops cached responses for items whose dmmodified has changed.
+
+        records is a list of (alias, id, dmmodified) tuples."""
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                for alias, id, modified in records:
+                    row = self.db.execute('SELECT modified FROM items WHERE alias = ? AND id = ?',
+                        (alias, id)).fetchone()
+                    if row is not None and row[0] == modified:
+                        continue
+                    self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?)', (alias, id, modified))
+                    if row is not None:
+                        self.delete(alias, id)
+                        continue
+                    # first dmmodified seen for the item: keep responses that must be newer
+                    for url, stored, fetched, size in self.db.execute('SELECT url, modified, fetched, size '
+                            'FROM responses WHERE alias = ? AND id = ?', (alias, id)).fetchall():
+                        if stored == modified:
+                            continue
+                        if stored is None and fetchedafter(fetched, modified):
+                            self.db.execute('UPDATE responses SET modified = ? WHERE url = ?', (modified, url))
+                        else:
+                            self.db.execute('DELETE FROM responses WHERE url = ?', (url,))
+                            self.size -= size
+            finally:
+                self.db.execute('COMMIT')
+
+    def delete(self, alias, id):
+        rows = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses WHERE alias = ? AND id = ?',
+            (alias, id)).fetchone()
+        self.db.execute('DELETE FROM responses WHERE alias = ? AND id = ?', (alias, id))
+        self.size -= rows[0]
+
+    def invalidate(self, alias, id=None):
+        """Drops cached responses for an item, or for every item in a collection if id is None."""
+        with self.lock:
+            if id is not None:
+                self.delete(alias, id)
+            else:
+                self.db.execute('DELETE FROM responses WHERE alias = ?', (alias,))
+                self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def clear(self):
+        """Drops all cached responses."""
+        with self.lock:
+            self.db.execute('DELETE FROM responses')
+            self.db.execute('DELETE FROM items')
+            self.size = 0
+
+    def close(self):
+        self.db.close()
+
+
+def fetchedafter(fetched, modified):
+    """Returns whether a response fetched at fetched (seconds since the epoch) is newer than
+    an item last modified on the date modified (YYYY-MM-DD): fetched from the start (UTC) of
+    the second day after that date, before which the date may not have ended everywhere."""
+    try:
+        day = calendar.timegm(time.strptime(modified[:10], '%Y-%m-%d'))
+    except ValueError:
+        return False
+    return fetched >= day + 2 * 86400
+
+
+def splitcall(url):
+    """Splits a dmwebservices URL into its function name and list of arguments (without format)."""
+    if 'index.php?q=' not in url:
+        return None, []
+    parts = url.split('index.php?q=', 1)[1].split('/')
+    return parts[0], parts[1:-1]
+
+
+class JSONReader:
+    """Decodes a JSON document piece by piece as its bytes arrive from an iterable of chunks.
+
+    Step through objects with members() and arrays with elements(), and decode the
+    values you want whole with value(), so large responses never need to be held in
+    memory at once. Keywords (e.g. object_hook) are passed to json.JSONDecoder.
+
+        reader = JSONReader(chunks)
+        for key in reader.members():
+            if key == 'records':
+                for n in reader.elements():
+                    record = reader.value()
+            else:
+                reader.value()
+
+    Attributes:
+        seconds     Total seconds spent decoding values
+    """
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, chunks, **kwds):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder(**kwds)
+        self.seconds = 0.0
+
+    def more(self):
+        """Reads the next chunk into the buffer. Returns False at the end of the data."""
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """Returns the next non-whitespace character, without consuming it."""
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                raise ValueError('Unexpected end of JSON data')
+
+    def expect(self, chars):
+        """Consumes and returns the next non-whitespace character, which must be one of chars."""
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expecting %s at byte %d: %r' % (' or '.join(chars), self.pos, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decodes and returns the next whole JSON value."""
+        self.peek()
+        while True:
+            started = time.time()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # most likely the value is cut off at the end of the buffer
+                self.seconds += time.time() - started
+                if not self.more():
+                    raise
+                continue
+            self.seconds += time.time() - started
+            # a number ending the buffer may continue in the next chunk
+            if end == len(self.buffer) and isinstance(value, (int, long, float)) and self.more():
+                continue
+            self.pos = end
+            return value
+
+    def finish(self):
+        """Reads the rest of the data, which must be only whitespace."""
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                raise ValueError('Extra data at byte %d: %r' % (self.pos, self.buffer[self.pos:self.pos + 20]))
+            if not self.more():
+                return
+
+    def members(self):
+        """Generator yielding each key of the next JSON object. The caller must consume each
+        member's value (with value(), members() or elements()) before asking for the next key."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Generator yielding True for each element of the next JSON array. The caller must
+        consume each element before asking for the next."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield True
+            if self.expect(',]') == ']':
+                return
+
+
+class QueryStream:
+    """The records of a dmQuery response, decoded one at a time as the response arrives.
+
+    Iterate over it once for the records (dicts, as in the dmQuery response). Made by
+    Api.dmQuery(..., ret='records').
+
+    Attributes:
+        url         The dmQuery URL
+        pager       The response's pager dict (start, maxrecs, total), once read
+        count       The number of records read so far
+    """
+    def __init__(self, api, url):
+        self.api = api
+        self.url = url
+        self.pager = None
+        self.count = 0
+
+    def __iter__(self):
+        reader = JSONReader(self.api.stream(self.url), object_hook=empty_to_str)
+        validate = self.api.cache is not None and 'dmmodified' in splitcall(self.url)[1][2].split('!')
+        modified = []
+        for key in reader.members():
+            if key == 'records':
+                for n in reader.elements():
+                    r = reader.value()
+                    self.count += 1
+                    if validate:
+                        modified.append((r['collection'].replace('/', ''), str(r['pointer']), r['dmmodified']))
+                    yield r
+            elif key == 'pager':
+                self.pager = reader.value()
+            else:
+                reader.value()
+        reader.finish()
+        self.api.metrics.record('dmQuery', 'decode', reader.seconds)
+        if validate:
+            # drop cached item responses the query shows are out of date
+            self.api.cache.validate(modified)
+
+
+def compoundpages(reader):
+    """Generator yielding (nodetitles, pageinfo) for each page in a dmGetCompoundObjectInfo response,
+    decoding one page at a time from a JSONReader.
+
+    nodetitles is a tuple of the titles of the nodes holding the page, outermost first (empty
+    for pages at the top of the object); pageinfo is the page's dict (pagetitle, pagefile,
+    pageptr). Nodes are walked with a stack rather than recursion, so any depth is fine."""
+    # each frame is an object being read (a node, or the whole response), or an array of nodes
+    frames = [{'members': reader.members(), 'parent': (), 'titles': (), 'held': []}]
+    while frames:
+        frame = frames[-1]
+        if 'nodes' in frame:
+            if next(frame['nodes'], False):
+                frames.append({'members': reader.members(), 'parent': frame['parent'], 'titles': None, 'held': []})
+            else:
+                frames.pop()
+            continue
+        key = next(frame['members'], None)
+        if key == 'nodetitle' and frame['titles'] is None:
+            frame['titles'] = frame['parent'] + (reader.value(),)
+        elif key == 'page':
+            if reader.peek() == '[':
+                pages = (reader.value() for n in reader.elements())
+            else:
+                pages = [reader.value()]
+            for page in pages:
+                if frame['titles'] is None:
+                    frame['held'].append(page)
+                else:
+                    yield frame['titles'], page
+            continue
+        elif key is not None and key != 'node':
+            reader.value()
+            continue
+        if frame['titles'] is None and key != 'nodetitle':
+            # a node with pages or nodes ahead of its title, or no title
+            frame['titles'] = frame['parent'] + (u'',)
+        for page in frame['held']:
+            yield frame['titles'], page
+        frame['held'] = []
+        if key is None:
+            frames.pop()
+        elif key == 'node':
+            if reader.peek() == '[':
+                frames.append({'nodes': reader.elements(), 'parent': frame['titles']})
+            else:
+                frames.append({'members': reader.members(), 'parent': frame['titles'], 'titles': None, 'held': []})
+
+
+class Metrics:
+    """Per-endpoint counters for Api requests, with hooks called around each request.
+
+    Every Api records into the module metrics object (or the one it was given), so
+    pycdm.metrics.report() shows which dmwebservices functions a harvest spends its
+    calls and time on. Use profile() to measure just a block of code.
+
+    Hooks are functions added with addhook(event, func) and called as:
+        'before'    func(function, url) before a request is sent
+        'after'     func(function, url, body, seconds) after a response is read (body is
+                    None for responses streamed with Api.stream())
+        'error'     func(function, url, error, seconds) when a request fails
+
+    Attributes:
+        endpoints   A dict of EndpointStats with dmwebservices function as key
+        hooks       A dict of lists of hook functions with event as key
+        started     Time the metrics were created or last reset
+        stopped     Time a profile() block ended, or None
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = {'before': [], 'after': [], 'error': []}
+        self.listeners = []
+        self.reset()
+
+    def reset(self):
+        """Zeroes all counters."""
+        with self.lock:
+            self.endpoints = {}
+            self.started = time.time()
+            self.stopped = None
+
+    def addhook(self, event, func):
+        self.hooks[event].append(func)
+
+    def removehook(self, event, func):
+        self.hooks[event].remove(func)
+
+    def endpoint(self, function):
+        stats = self.endpoints.get(function)
+        if stats is None:
+            stats = self.endpoints[function] = EndpointStats(function)
+        return stats
+
+    def record(self, function, kind, value=0):
+        """Adds a measurement to an endpoint's counters and those of any profile() in progress.
+
+        kind is 'response' (value is (bytes, seconds)), 'error' (value is seconds),
+        'decode' (value is seconds) or 'cached' (value is bytes)."""
+        with self.lock:
+            self.endpoint(function).add(kind, value)
+        for listener in self.listeners:
+            listener.record(function, kind, value)
+
+    def before(self, function, url):
+        for hook in self.hooks['before']:
+            hook(function, url)
+
+    def after(self, function, url, body, seconds, size=None):
+        if size is None:
+            size = len(body)
+        self.record(function, 'response', (size, seconds))
+        for hook in self.hooks['after']:
+            hook(function, url, body, seconds)
+
+    def error(self, function, url, error, seconds):
+        self.record(function, 'error', seconds)
+        for hook in self.hooks['error']:
+            hook(function, url, error, seconds)
+
+    def calls(self):
+        """Returns the total number of requests sent (including failed ones)."""
+        return sum(stats.calls + stats.errors for stats in self.endpoints.values())
+
+    def report(self):
+        """Returns a table of calls, cache hits, errors, bytes and timings per endpoint."""
+        elapsed = (self.stopped or time.time()) - self.started
+        lines = ['%-32s %7s %7s %7s %11s %9s %9s %9s %9s %9s' % ('function', 'calls', 'cached', 'errors',
+            'bytes', 'seconds', 'decode', 'mean ms', 'p95 ms', 'max ms')]
+        endpoints = sorted(self.endpoints.values(), key=lambda stats: -stats.seconds)
+        for stats in endpoints:
+            lines.append('%-32s %7d %7d %7d %11d %9.3f %9.3f %9.1f %9.1f %9.1f' % (stats.function, stats.calls,
+                stats.cached, stats.errors, stats.bytes, stats.seconds, stats.decode, stats.mean() * 1000,
+                stats.percentile(95) * 1000, stats.max * 1000))
+        lines.append('%d calls in %.3f seconds' % (self.calls(), elapsed))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
+
+
+class EndpointStats:
+    """Counters for the requests made to one dmwebservices function.
+
+    Attributes:
+        function    The dmwebservices function name
+        calls       Number of successful requests
+        cached      Number of responses answered from the ResponseCache
+        errors      Number of failed requests
+        bytes       Bytes received
+        seconds     Total seconds spent waiting on requests
+        decode      Total seconds spent decoding JSON responses
+        max         Slowest request in seconds
+        histogram   List of request counts per latency bucket (see buckets)
+    """
+    # upper bounds (in seconds) of the latency histogram buckets
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+        self.cached = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.decode = 0.0
+        self.max = 0.0
+        self.histogram = [0] * len(self.buckets)
+
+    def add(self, kind, value):
+        if kind == 'response':
+            self.calls += 1
+            self.bytes += value[0]
+            self.latency(value[1])
+        elif kind == 'error':
+            self.errors += 1
+            self.latency(value)
+        elif kind == 'decode':
+            self.decode += value
+        elif kind == 'cached':
+            self.cached += 1
+            self.bytes += value
+
+    def latency(self, seconds):
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        for n, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.histogram[n] += 1
+                break
+
+    def mean(self):
+        requests = self.calls + self.errors
+        return self.seconds / requests if requests else 0.0
+
+    def percentile(self, percent):
+        """Returns the upper bound of the histogram bucket holding the given percentile of latencies."""
+        requests = sum(self.histogram)
+        count = 0
+        for n, bound in enumerate(self.buckets):
+            count += self.histogram[n]
+            if requests and count * 100.0 >= requests * percent:
+                return min(bound, self.max)
+        return 0.0
+
+    def __repr__(self):
+        return '<EndpointStats %s: %d calls, %.3f seconds>' % (self.function, self.calls, self.seconds)
+
+
+@contextlib.contextmanager
+def profile(metrics=None):
+    """Context manager that counts the Api requests made inside a block of code, in any thread.
+
+        with pycdm.profile() as calls:
+            pycdm.item('cookbooks', '1234', pageinfo='on')
+        print calls.report()
+
+    Yields a Metrics object that holds only the requests made while the block ran."""
+    if metrics is None:
+        metrics = globals()['metrics']
+    block = Metrics()
+    metrics.listeners = metrics.listeners + [block]
+    try:
+        yield block
+    finally:
+        metrics.listeners = [listener for listener in metrics.listeners if listener is not block]
+        block.stopped = time.time()
+
+
+class TokenBucket:
+    """Allows on average `rate` calls to take() per second, in bursts of up to `burst` calls.
+
+    Attributes:
+        rate        Tokens added per second
+        burst       Max tokens held
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Takes a token, sleeping until one is available."""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # reserve the token now and wait for it outside the lock, so callers are served in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Throttles requests to the CONTENTdm server.
+
+    Requests are held to a global rate (requests per second) and to per-function rates,
+    and at most `concurrency` requests are in flight at once. If adaptive, the concurrency
+    limit follows the server's health: it is halved when a request fails with a 5xx
+    status or a socket error, or when the average latency rises past `slowdown` times the
+    lowest average seen, and grows by one after each `concurrency` successful requests,
+    between minconcurrency and maxconcurrency.
+
+    Set pycdm.ratelimiter to share one limiter between all Api instances:
+
+        pycdm.ratelimiter = pycdm.RateLimiter(rate=20, rates={'dmQuery': 1}, adaptive=True)
+
+    Attributes:
+        rate            Max requests per second, or None for no limit
+        rates           A dict of max requests per second with dmwebservices function as key
+        concurrency     Current max requests in flight
+        minconcurrency  Lowest concurrency adaptive limiting backs off to
+        maxconcurrency  Highest concurrency adaptive limiting ramps up to
+        adaptive        If True, concurrency is adjusted to latency and errors
+        slowdown        Latency increase (as a multiple of the baseline) that counts as overload
+        latency         Moving average of request latency in seconds
+        baseline        Lowest moving average latency seen
+    """
+    def __init__(self, rate=None, rates=None, concurrency=None, adaptive=False, minconcurrency=1,
+        maxconcurrency=None, slowdown=2.0):
+        self.rate = rate
+        self.rates = dict(rates or {})
+        self.bucket = TokenBucket(rate) if rate else None
+        self.buckets = dict((function, TokenBucket(r)) for function, r in self.rates.items())
+        self.maxconcurrency = maxconcurrency or max(concurrency or maxworkers, maxworkers) * 4
+        self.minconcurrency = minconcurrency
+        self.concurrency = concurrency or (maxworkers if adaptive else self.maxconcurrency)
+        self.adaptive = adaptive
+        self.slowdown = slowdown
+        self.latency = None
+        self.baseline = None
+        self.inflight = 0
+        self.successes = 0
+        self.lastcut = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, function):
+        """Waits for a free request slot and for the rate limits to allow a request to function."""
+        with self.condition:
+            while self.inflight >= self.concurrency:
+                self.condition.wait()
+            self.inflight += 1
+        if self.bucket is not None:
+            self.bucket.take()
+        bucket = self.buckets.get(function)
+        if bucket is not None:
+            bucket.take()
+
+    def release(self, seconds, status=200):
+        """Frees a request slot, adjusting concurrency to the request's latency and HTTP status
+        (None for a request that failed without a response)."""
+        with self.condition:
+            self.inflight -= 1
+            if self.adaptive:
+                self.adapt(seconds, status)
+            self.condition.notify_all()
+
+    def adapt(self, seconds, status):
+        now = time.time()
+        if status is None or status >= 500:
+            self.backoff(now)
+            return
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * seconds
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        if self.latency > self.baseline * self.slowdown:
+            self.backoff(now)
+            return
+        self.successes += 1
+        if self.successes >= self.concurrency:
+            self.successes = 0
+            self.concurrency = min(self.concurrency + 1, self.maxconcurrency)
+
+    def backoff(self, now):
+        # cut at most once per round trip, since requests already in flight report the same trouble
+        if now - self.lastcut < (self.latency or 0):
+            return
+        self.lastcut = now
+        self.successes = 0
+        self.concurrency = max(self.concurrency // 2, self.minconcurrency)
+        # let the baseline drift up, so a server that stays slower is not treated as overloaded forever
+        if self.baseline is not None and self.latency is not None:
+            self.baseline = max(self.baseline, self.latency / self.slowdown)
+
+
+class SingleFlight:
+    """Merges identical calls made at the same time, so only one of them runs.
+
+    The first caller of call() with a key runs the function; callers arriving with the
+    same key while it runs wait for it and get the same result (or error). Once it
+    finishes the key is forgotten, so later calls run again.
+
+    Attributes:
+        calls       A dict of the Tasks running now, with key as key
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def call(self, key, func, *args):
+        """Returns func(*args), sharing the result with identical calls in progress."""
+        with self.lock:
+            task = self.calls.get(key)
+            leader = task is None
+            if leader:
+                task = self.calls[key] = Task(func, args)
+        if leader:
+            try:
+                task.run()
+            finally:
+                with self.lock:
+                    del self.calls[key]
+        return task.get()
+
+
+# default transport shared by all Api instances
+pool = ConnectionPool()
+# optional ResponseCache shared by all Api instances
+responsecache = None
+# request counters and hooks shared by all Api instances
+metrics = Metrics()
+# optional RateLimiter shared by all Api instances
+ratelimiter = None
+# identical requests in flight, merged for all Api instances
+inflight = SingleFlight()
+
 
 class Api:
     """Class for interacting with the CDM Api.
@@ -455,11 +2089,152 @@ class Api:
     See: http://www.contentdm.org/help6/custom/customize2a.asp for full
     documentation on API calls.
 
+    base and port default to the module's base and port at the time the Api is created.
+
     Attributes:
-        base    The base url plus port for making calls to the CDM API
+        base        The base url plus port for making calls to the CDM API
+        transport   The transport used to send requests (defaults to the shared
+                    module ConnectionPool)
+        cache       The ResponseCache for responses (defaults to the module responsecache;
+                    pass cache=False to skip caching)
+        metrics     The Metrics requests are counted in (defaults to the module metrics)
+        limiter     The RateLimiter requests are throttled by (defaults to the module
+                    ratelimiter; pass limiter=False for none)
+        flights     The SingleFlight identical requests in progress are merged in, so they
+                    share one response body, decoded separately for each caller (defaults to the module inflight; pass flights=False
+                    to always send every request)
     """
-    def __init__(self, base=base, port=port):
+    def __init__(self, base=None, port=None, transport=None, cache=None, metrics=None, limiter=None,
+        flights=None):
+        if base is None:
+            base = globals()['base']
+        if port is None:
+            port = globals()['port']
         self.base = base + port
+        if transport is None:
+            transport = pool
+        self.transport = transport
+        if cache is None:
+            cache = responsecache
+        self.cache = cache or None
+        if metrics is None:
+            metrics = globals()['metrics']
+        self.metrics = metrics
+        if limiter is None:
+            limiter = ratelimiter
+        self.limiter = limiter or None
+        if flights is None:
+            flights = inflight
+        self.flights = flights or None
+
+    def fetch(self, url):
+        """Sends a GET request through the transport and returns the response body."""
+        function = splitcall(url)[0]
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                self.metrics.record(function, 'cached', len(body))
+                return body
+            if self.cache.offline:
+                raise CacheMiss('Not in cache: ' + url)
+        self.metrics.before(function, url)
+        if self.limiter is not None:
+            self.limiter.acquire(function)
+        started = time.time()
+        try:
+            response = self.transport.urlopen(url)
+            try:
+                body = response.read()
+            finally:
+                response.close()
+        except Exception as e:
+            seconds = time.time() - started
+            if self.limiter is not None:
+                self.limiter.release(seconds, getattr(e, 'code', None))
+            self.metrics.error(function, url, e, seconds)
+            raise
+        seconds = time.time() - started
+        if self.limiter is not None:
+            self.limiter.release(seconds)
+        self.metrics.after(function, url, body, seconds)
+        if self.cache is not None:
+            self.cache.put(url, body)
+        return body
+
+    def stream(self, url, chunksize=65536):
+        """Generator yielding the response body for url in chunks of up to chunksize bytes as
+        they arrive, so the whole body is never held in memory (unless it is to be cached)."""
+        function = splitcall(url)[0]
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                self.metrics.record(function, 'cached', len(body))
+                yield body
+                return
+            if self.cache.offline:
+                raise CacheMiss('Not in cache: ' + url)
+        keep = self.cache is not None and self.cache.ttl(function) != 0
+        chunks = []
+        size = 0
+        error = None
+        self.metrics.before(function, url)
+        if self.limiter is not None:
+            self.limiter.acquire(function)
+        started = time.time()
+        try:
+            response = self.transport.urlopen(url)
+        except Exception as e:
+            seconds = time.time() - started
+            if self.limiter is not None:
+                self.limiter.release(seconds, getattr(e, 'code', None))
+            self.metrics.error(function, url, e, seconds)
+            raise
+        # the limiter slot is freed once the headers arrive rather than held across yields,
+        # since the body is read at the caller's pace and the caller may make requests of its own
+        if self.limiter is not None:
+            self.limiter.release(time.time() - started)
+        try:
+            try:
+                while True:
+                    chunk = response.read(chunksize)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if keep:
+                        chunks.append(chunk)
+                    yield chunk
+            finally:
+                response.close()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # also reached when the caller stops reading early
+            seconds = time.time() - started
+            if error is not None:
+                self.metrics.error(function, url, error, seconds)
+            else:
+                self.metrics.after(function, url, None, seconds, size)
+        if keep:
+            self.cache.put(url, ''.join(chunks))
+
+    def fetchjson(self, url, **kwds):
+        """Fetches url and returns the decoded JSON response. Keywords are passed to json.loads.
+
+        Identical requests already in progress, from any Api in any thread, are waited on
+        and their response body shared instead of sending the request again. Each caller
+        decodes the body itself, so every caller gets objects of its own to modify."""
+        if self.flights is not None:
+            body = self.flights.call(url, self.fetch, url)
+        else:
+            body = self.fetch(url)
+        return self.decode(url, body, kwds)
+
+    def decode(self, url, body, kwds):
+        started = time.time()
+        response = json.loads(body, **kwds)
+        self.metrics.record(splitcall(url)[0], 'decode', time.time() - started)
+        return response
 
     def dmGetDublinCoreFieldInfo(self, format='json'):
         """Calls dmGetDublinCoreFieldInfo and returns json response.
@@ -467,8 +2242,7 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2e.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetDublinCoreFieldInfo', format]
         url = '/'.join(urlparts)
-        dcinfo = urllib2.urlopen(url).read()
-        return json.loads(dcinfo)
+        return self.fetchjson(url)
 
     def dmGetCollectionParameters(self, alias, format='json'):
         """Calls dmGetCollectionParameters and returns json response.
@@ -476,8 +2250,7 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2c.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetCollectionParameters', alias, format]
         url = '/'.join(urlparts)
-        collparaminfo = urllib2.urlopen(url).read()
-        return json.loads(collparaminfo)
+        return self.fetchjson(url)
 
     def dmGetCollectionFields(self, alias, format='json'):
         """Calls dmGetCollectionFields and returns json response.
@@ -485,8 +2258,7 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2d.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetCollectionFieldInfo', alias, format]
         url = '/'.join(urlparts)
-        fieldinfo = urllib2.urlopen(url).read()
-        return json.loads(fieldinfo)
+        return self.fetchjson(url)
 
     def dmGetCollectionFieldVocabulary(self, alias, field, format='json'):
         """Calls dmGetCollectionFieldVocabulary and returns json response.
@@ -495,8 +2267,7 @@ class Api:
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetCollectionFieldVocabulary', alias, field, format]
         url = '/'.join(urlparts)
         try:
-            fieldvocab = urllib2.urlopen(url).read()
-            return json.loads(fieldvocab)
+            return self.fetchjson(url)
         except ValueError:
             return []
 
@@ -506,8 +2277,7 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2f.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetItemInfo', alias, id, format]
         url = '/'.join(urlparts)
-        iteminfo = urllib2.urlopen(url).read()
-        return json.loads(iteminfo, object_hook=empty_to_str)
+        return self.fetchjson(url, object_hook=empty_to_str)
 
     def dmGetCompoundObjectInfo(self, alias, id, format='json'):
         """Calls dmGetCompoundObjectInfo and returns json response.
@@ -515,8 +2285,18 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2g.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=dmGetCompoundObjectInfo', alias, id, format]
         url = '/'.join(urlparts)
-        compoundinfo = urllib2.urlopen(url).read()
-        return json.loads(compoundinfo, object_pairs_hook=colls.OrderedDict)
+        return self.fetchjson(url, object_pairs_hook=colls.OrderedDict)
+
+    def dmGetCompoundObjectPages(self, alias, id, format='json'):
+        """Calls dmGetCompoundObjectInfo and yields (nodetitles, pageinfo) for each page as the
+        response arrives, without building the whole node tree. See compoundpages()."""
+        urlparts = [self.base, 'dmwebservices/index.php?q=dmGetCompoundObjectInfo', alias, id, format]
+        url = '/'.join(urlparts)
+        reader = JSONReader(self.stream(url), object_pairs_hook=colls.OrderedDict)
+        for entry in compoundpages(reader):
+            yield entry
+        reader.finish()
+        self.metrics.record('dmGetCompoundObjectInfo', 'decode', reader.seconds)
 
     def dmGetParent(self, alias, id, format='json'):
         """Calls GetParent and returns CDM item id of parent or '-1' if no parent.
@@ -524,23 +2304,28 @@ class Api:
         Full documentation at: http://www.contentdm.org/help6/custom/customize2i.asp"""
         urlparts = [self.base, 'dmwebservices/index.php?q=GetParent', alias, id, format]
         url = '/'.join(urlparts)
-        parent = urllib2.urlopen(url).read()
-        return json.loads(parent)['parent']
+        return self.fetchjson(url)['parent']
     
     def dmQuery(self, string, alias='all', field='CISOSEARCHALL', mode='exact', operator='and', maxrecs='10000',
         fields='title', sortby='nosort', start='1', suppress='1', docptr='0', suggest='0', facets='0',
         format='json', ret='items', sep="^"):
         """Calls dmQuery and returns a list of CDM item ids returned by the query.
 
-        Set ret to 'response' to return json reponse instead.
+        Set ret to 'response' to return json reponse instead, or to 'records' for a QueryStream
+        that decodes the response's records one at a time as they arrive.
         Full documentation at: http://www.contentdm.org/help6/custom/customize2h.asp"""
         string = string.replace(' ', '+')
         searchstrings = field + sep + string + sep + mode + sep + operator
         urlparts = [self.base, 'dmwebservices/index.php?q=dmQuery', alias, searchstrings, fields, sortby, maxrecs,
         start, suppress, docptr, suggest, facets, format]
         url = '/'.join(urlparts)
-        query = urllib2.urlopen(url).read()
-        response = json.loads(query, object_hook=empty_to_str)
+        if ret == 'records':
+            return QueryStream(self, url)
+        response = self.fetchjson(url, object_hook=empty_to_str)
+        if self.cache is not None and 'dmmodified' in fields.split('!'):
+            # drop cached item responses the query shows are out of date
+            self.cache.validate([(r['collection'].replace('/', ''), str(r['pointer']), r['dmmodified'])
+                for r in response['records']])
         if ret == 'response':
             return response
         else:
@@ -558,8 +2343,7 @@ class Api:
         if (find[-3:] == 'url'):
             urlparts = [self.base, 'dmwebservices', 'index.php?q=dmGetItemUrl', alias, find, format]
             url = '/'.join(urlparts)
-            query = urllib2.urlopen(url).read()
-            response = json.loads(query)
+            response = self.fetchjson(url)
             return response['URL']
 
     
@@ -597,10 +2381,65 @@ class Api:
         """
         urlparts = [self.base , 'dmwebservices', 'index.php?q=dmGetCollectionList',format]
         url = '/'.join(urlparts)
-        query = urllib2.urlopen(url).read()
-        response = json.loads(query)
+        response = self.fetchjson(url)
         return response
 
+class AsyncApi:
+    """Non-blocking counterpart to the Api class.
+
+    Every Api method is available with the same arguments, but returns right away with
+    an AsyncResult: call .get() on it for the decoded response (or the error the call
+    raised), or pass a callback=function keyword to have it called with the response
+    once it arrives. Calls run on a pool of worker threads sharing one transport. The
+    keywords other than workers are passed on to the Api calls are made with.
+
+        call = AsyncApi()
+        results = [call.dmGetItemInfo('cookbooks', id) for id in ids]
+        infos = [r.get() for r in results]
+
+    Attributes:
+        api         The Api instance calls are made with
+        workers     The number of calls run at once
+    """
+    def __init__(self, base=None, port=None, transport=None, workers=None, cache=None, metrics=None,
+        limiter=None, flights=None):
+        self.api = Api(base, port, transport, cache, metrics, limiter, flights)
+        self.workers = workers or maxworkers
+        self.threads = ThreadPool(self.workers)
+
+    def __getattr__(self, name):
+        if name == 'api':
+            raise AttributeError(name)
+        method = getattr(self.api, name)
+        if not callable(method):
+            return method
+        def call(*args, **kwds):
+            return self.submit(method, *args, **kwds)
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+    def submit(self, func, *args, **kwds):
+        """Runs func(*args, **kwds) on the worker pool and returns an AsyncResult.
+
+        A callback keyword is called with the return value of func when it succeeds."""
+        callback = kwds.pop('callback', None)
+        return self.threads.apply_async(func, args, kwds, callback)
+
+    def item(self, alias, id, pageinfo='off', toplevel=False, find=None, modified=None, callback=None):
+        """Creates an Item subclass instance with item() and returns an AsyncResult."""
+        return self.submit(item, alias, id, pageinfo, toplevel, find, modified, callback=callback)
+
+    def collection(self, alias, callback=None):
+        """Creates a Collection object, stores it in collections and returns an AsyncResult."""
+        return self.submit(collections.load, alias, callback=callback)
+
+    def close(self):
+        """Waits for outstanding calls to finish and stops the worker threads."""
+        self.threads.close()
+        self.threads.join()
+
+
 class UnicodeWriter:
     """
     A CSV writer which will write rows to CSV file "f",
@@ -608,13 +2447,23 @@ class UnicodeWriter:
     """
 
     def __init__(self, f, dialect=csv.excel, encoding="utf-8", **kwds):
-        # Redirect output to a queue
-        self.queue = cStringIO.StringIO()
-        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
         self.stream = f
+        self.encoding = encoding
         self.encoder = codecs.getincrementalencoder(encoding)()
+        if u',"\r\n'.encode(encoding) == ',"\r\n':
+            # encodings that leave ASCII alone (utf-8, latin-1...) are written straight
+            # to the stream, encoding each cell once
+            self.queue = None
+            self.writer = csv.writer(f, dialect=dialect, **kwds)
+        else:
+            # Redirect output to a queue
+            self.queue = cStringIO.StringIO()
+            self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
 
     def writerow(self, row):
+        if self.queue is None:
+            self.writer.writerow([unicode(s).encode(self.encoding) for s in row])
+            return
         self.writer.writerow([unicode(s).encode("utf-8") for s in row])
         # Fetch UTF-8 output from the queue ...
         data = self.queue.getvalue()
@@ -630,19 +2479,57 @@ class UnicodeWriter:
         for row in rows:
             self.writerow(row)
 
+class OutputFile:
+    """A file opened for writing that collects writes and passes them on in large chunks.
+
+    Attributes:
+    filename    The filename of the file
+    compress    Whether the file is gzipped
+    buffersize  Bytes collected before writing them to the file
+    """
+    def __init__(self, filename, compress=False, buffersize=1024 * 1024):
+        self.filename = filename
+        self.compress = compress
+        self.buffersize = buffersize
+        self.raw = open(filename, 'wb')
+        if compress:
+            self.f = gzip.GzipFile(filename=os.path.basename(filename), mode='wb', fileobj=self.raw)
+        else:
+            self.f = self.raw
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        self.f.write(''.join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        if self.f is not self.raw:
+            self.raw.close()
+
+
 class CSV:
     """A CSV object to make writing unicode data to CSV easier.
 
     Attributes:
     filename    The filename of the CSV file
-    f           The CSV file
+    f           The CSV file (an OutputFile)
     wtr         A UnicodeWriter for the CSV file
     header      The header row of the CSV file (optional)
     """
-    def __init__(self, filename, header=None):
+    def __init__(self, filename, header=None, compress=False, buffersize=1024 * 1024, encoding='utf-8'):
         self.filename = filename
-        self.f = open(self.filename, 'wb')
-        self.wtr = UnicodeWriter(self.f)
+        self.f = OutputFile(self.filename, compress, buffersize)
+        self.wtr = UnicodeWriter(self.f, encoding=encoding)
         if header is not None:
             self.wtr.writerow(header)
         self.header = header
@@ -655,6 +2542,988 @@ class CSV:
         """Closes the CSV file."""
         self.f.close()
 
+
+class JSONLines:
+    """A JSON Lines file (one UTF-8 JSON object per line) to write records to.
+
+    Attributes:
+    filename    The filename of the file
+    f           The file (an OutputFile)
+    """
+    def __init__(self, filename, compress=False, buffersize=1024 * 1024):
+        self.filename = filename
+        self.f = OutputFile(self.filename, compress, buffersize)
+
+    def writerow(self, obj):
+        """Writes an object (e.g. a dict) as a line of the file."""
+        line = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        self.f.write(line + '\n')
+
+    def close(self):
+        """Closes the file."""
+        self.f.close()
+
+
+def export(items, filename, level='item', format='csv', fields=None, compress=False, buffersize=1024 * 1024):
+    """Writes a row for each item, page or Dublin Core record in items to a CSV or JSON Lines file.
+
+    items can be any iterable of items, e.g. from items(); ItemErrors are skipped. level is
+    'item' (info of each item), 'page' (info of each page, or just its label and file if
+    page metadata wasn't fetched) or 'dc' (dcinfo of each item). format is 'csv' or
+    'jsonl'. fields is the list of field nicknames (DC field names for 'dc') to write,
+    by default all fields of the first item's collection. Rows are written as items
+    arrive, so any number of items can be exported. Returns the number of rows written."""
+    out = None
+    rows = 0
+    try:
+        for obj in items:
+            if isinstance(obj, ItemError):
+                continue
+            if out is None:
+                if fields is None:
+                    fields = exportfields(obj.collection, level)
+                out, header = openexport(filename, level, format, fields, compress, buffersize)
+            for row in exportrows(obj, level, fields):
+                if format == 'csv':
+                    out.writerow(row)
+                else:
+                    out.writerow(colls.OrderedDict(zip(header, row)))
+                rows += 1
+        if out is None:
+            out, header = openexport(filename, level, format, fields or [], compress, buffersize)
+    finally:
+        if out is not None:
+            out.close()
+    return rows
+
+def exportfields(collection, level):
+    """Returns the default export fields of a collection: sorted field nicknames, or DC fields for 'dc'."""
+    if level == 'dc':
+        return sorted(set(dc for dc in collection.dcmap.values() if dc))
+    return sorted(collection.fields.keys())
+
+def openexport(filename, level, format, fields, compress, buffersize):
+    """Opens an export file, writing the CSV header row. Returns the file and its header."""
+    if level == 'page':
+        header = ['alias', 'itemid', 'id', 'label', 'file'] + list(fields)
+    elif level in ('item', 'dc'):
+        header = ['alias', 'id'] + list(fields)
+    else:
+        raise RuntimeError('Unknown export level: ' + level)
+    if format == 'csv':
+        return CSV(filename, header=header, compress=compress, buffersize=buffersize), header
+    elif format == 'jsonl':
+        return JSONLines(filename, compress=compress, buffersize=buffersize), header
+    else:
+        raise RuntimeError('Unknown export format: ' + format)
+
+def exportrows(obj, level, fields):
+    """Generator yielding the export rows (lists of values) for an item."""
+    if level == 'item':
+        info = obj.info
+        yield [obj.alias, obj.id] + [info.get(f, '') for f in fields]
+    elif level == 'dc':
+        dc = obj.dcinfo
+        yield [obj.alias, obj.id] + [dc.get(f, '') for f in fields]
+    else:
+        for p in obj.pages:
+            info = getattr(p, 'info', {})
+            yield [obj.alias, obj.id, p.id, p.label, p.file] + [info.get(f, '') for f in fields]
+
+def savesnapshot(items, filename, collection=None, compress=False):
+    """Saves items, with their nodes, pages and metadata, and their Collection to a snapshot file.
+
+    items can be any iterable of items of one collection, e.g. from items(); ItemErrors are
+    skipped. collection defaults to the first item's Collection. Each item is marshalled as
+    it arrives and only an index of offsets is kept in memory, so any number of items can
+    be saved. compress=True zlib-compresses each item. Open the file with Snapshot. Returns
+    the number of items saved."""
+    tmp = filename + '.tmp'
+    index = {}
+    ids = []
+    alias = None
+    with open(tmp, 'wb') as f:
+        f.write(struct.pack(snapshotheader, snapshotmagic, snapshotversion, 0))
+        for obj in items:
+            if isinstance(obj, ItemError):
+                continue
+            if alias is None:
+                alias = obj.alias
+                if collection is None:
+                    collection = obj.collection
+            elif obj.alias != alias:
+                raise RuntimeError('Snapshot items must all be in one collection: ' + alias + ', ' + obj.alias)
+            data = marshal.dumps(packitem(obj))
+            if compress:
+                data = zlib.compress(data, 1)
+            if obj.id not in index:
+                ids.append(obj.id)
+            index[obj.id] = (f.tell(), len(data))
+            f.write(data)
+        footer = {'alias': alias, 'compress': compress, 'ids': ids, 'index': index,
+            'collection': packcollection(collection) if collection is not None else None}
+        offset = f.tell()
+        marshal.dump(footer, f)
+        f.seek(0)
+        f.write(struct.pack(snapshotheader, snapshotmagic, snapshotversion, offset))
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp, filename)
+    return len(ids)
+
+# snapshot files start with the magic, format version and offset of the footer (alias, index and collection)
+snapshotmagic = 'PYCDMSNP'
+snapshotheader = '>8sHQ'
+
+
+class Snapshot:
+    """A snapshot file written by savesnapshot(), read without any API calls.
+
+    The file is memory-mapped and only its index is read on opening; each item is rebuilt
+    the first time it is asked for by id, so very large collections open quickly.
+
+        with pycdm.Snapshot('leighhunt.snap') as snap:
+            letter = snap['1566']
+            for i in snap:
+                print i.info['title']
+
+    Attributes:
+        filename    Path of the snapshot file
+        alias       The collection alias
+        collection  The Collection object saved with the items (not stored in collections)
+        ids         A list of the ids of all items in the snapshot, in the order saved
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = struct.calcsize(snapshotheader)
+        magic, version, offset = struct.unpack(snapshotheader, self.data[:size])
+        if magic != snapshotmagic:
+            self.close()
+            raise RuntimeError('Not a pycdm snapshot: ' + filename)
+        if version != snapshotversion:
+            self.close()
+            raise RuntimeError('Unsupported snapshot version %d: %s' % (version, filename))
+        footer = marshal.loads(self.data[offset:])
+        self.alias = footer['alias']
+        self.compress = footer['compress']
+        self.ids = footer['ids']
+        self.index = footer['index']
+        self.collection = None
+        if footer['collection'] is not None:
+            self.collection = unpackcollection(footer['collection'])
+
+    def __getitem__(self, id):
+        """Rebuilds and returns the item with CDM id id."""
+        offset, length = self.index[str(id)]
+        data = self.data[offset:offset + length]
+        if self.compress:
+            data = zlib.decompress(data)
+        return unpackitem(marshal.loads(data), self.collection)
+
+    def get(self, id, default=None):
+        if str(id) not in self.index:
+            return default
+        return self[id]
+
+    def __contains__(self, id):
+        return str(id) in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """Yields every item, in the order saved."""
+        for id in self.ids:
+            yield self[id]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def packitem(obj):
+    """Returns an item as a tuple of builtin types for marshal (see unpackitem())."""
+    urls = (obj._refurl, obj._fileurl, obj._imageurl, obj._thumburl) if isinstance(obj, Singlepage) else obj.refurl
+    if isinstance(obj, SinglePageItem):
+        return ('single', obj.alias, obj.id, obj.info, obj.dcinfo, (obj.label, obj.file, obj.parentnodetitle, urls),
+            [], [], [])
+    kind = 'monograph' if isinstance(obj, Monograph) else 'document'
+    pages = []
+    nodes = []
+    # the structure in document order, as (index of the containing node or -1, kind, index)
+    layout = []
+    positions = {}
+    stack = [(-1, iter(obj.structure))]
+    while stack:
+        container, children = stack[-1]
+        for child in children:
+            if isinstance(child, Node):
+                positions[id(child)] = len(nodes)
+                layout.append((container, 'node', len(nodes)))
+                nodes.append((child.nodetitle, child.parentnodetitle, child.start, child.end))
+                stack.append((positions[id(child)], iter(child.structure)))
+                break
+            layout.append((container, 'page', len(pages)))
+            pages.append(packpage(child))
+        else:
+            stack.pop()
+    return (kind, obj.alias, obj.id, obj.info, obj.dcinfo, urls, pages, nodes, layout)
+
+def packpage(page):
+    return (page.id, page.label, page.file, page.parentnodetitle, page.parentId, getattr(page, 'info', None),
+        getattr(page, 'dcinfo', None), (page._refurl, page._fileurl, page._imageurl, page._thumburl))
+
+def unpackitem(packed, collection):
+    """Rebuilds an item from packitem()'s tuple, without any API calls."""
+    kind, alias, id, info, dcinfo, extra, pages, nodes, layout = packed
+    if kind == 'single':
+        obj = blank(SinglePageItem)
+        obj.label, obj.file, obj.parentnodetitle, urls = extra
+        obj._refurl, obj._fileurl, obj._imageurl, obj._thumburl = urls
+    else:
+        obj = blank(Monograph if kind == 'monograph' else Document)
+        obj.refurl = extra
+    obj.alias = alias
+    obj.id = id
+    obj.collection = collection
+    obj.info = info
+    obj.dcinfo = dcinfo
+    if kind == 'single':
+        obj.pages = obj.getPages()
+        return obj
+    pages = [unpackpage(p, alias) for p in pages]
+    nodes = [unpacknode(n, alias, id, pages) for n in nodes]
+    obj.structure = []
+    for container, entry, n in layout:
+        parent = obj.structure if container == -1 else nodes[container].structure
+        parent.append(nodes[n] if entry == 'node' else pages[n])
+    if kind == 'monograph':
+        obj.allpages = pages
+    obj.pages = obj.getPages()
+    return obj
+
+def unpackpage(packed, alias):
+    page = blank(Page)
+    page.alias = alias
+    (page.id, page.label, page.file, page.parentnodetitle, page.parentId, info, dcinfo,
+        (page._refurl, page._fileurl, page._imageurl, page._thumburl)) = packed
+    if info is not None:
+        page.info = info
+        page.dcinfo = dcinfo
+    return page
+
+def unpacknode(packed, alias, parentId, pages):
+    node = blank(Node)
+    node.alias = alias
+    node.parentId = parentId
+    node.nodetitle, node.parentnodetitle, node.start, node.end = packed
+    node.structure = []
+    node.allpages = pages
+    node._pages = None
+    return node
+
+def packcollection(collection):
+    """Returns a Collection as a dict of builtin types for marshal. Vocabularies not yet
+    fetched are left to be fetched when first read."""
+    fields = []
+    for f in collection.fields.values():
+        fieldinfo = {'name': f.name, 'nick': f.nick, 'dc': f.dc, 'req': f.req, 'hide': f.hide,
+            'search': f.search, 'vocab': f.vocab}
+        if f.vocabloaded:
+            fieldinfo['vocabterms'] = f._vocabterms
+        fields.append(fieldinfo)
+    return {'name': collection.name, 'alias': collection.alias, 'url': collection.url, 'fields': fields,
+        'dcmap': collection.dcmap, 'items': getattr(collection, 'items', None)}
+
+def unpackcollection(packed):
+    collection = blank(Collection)
+    collection.name = packed['name']
+    collection.alias = packed['alias']
+    collection.url = packed['url']
+    collection.fields = {}
+    for fieldinfo in packed['fields']:
+        field = Field(collection.alias, fieldinfo, loadvocab=False)
+        if 'vocabterms' in fieldinfo:
+            field.vocabterms = fieldinfo['vocabterms']
+        collection.fields[field.nick] = field
+    collection.dcmap = packed['dcmap']
+    if packed['items'] is not None:
+        collection.items = packed['items']
+    return collection
+
+def blank(cls):
+    """Returns an instance of cls without calling its __init__."""
+    if isinstance(cls, type):
+        return cls.__new__(cls)
+    return types.InstanceType(cls)
+
+class Index:
+    """A local inverted index of item and page metadata, searched without API calls.
+
+    Every info field is indexed under its nickname, and every dcinfo field under 'dc.' and
+    its DC name. Values are split into lowercase words. Items added again replace their
+    old entries, pages included, so the index can be kept up to date as items change.
+
+        index = pycdm.Index()
+        for i in index.ingest(pycdm.items('leighhunt', leighhunt.items, pageinfo='on')):
+            pass
+        index.search('transc:wicklow AND (subjec:letters OR dc.type:text) NOT dreams*')
+
+    Queries are words, optionally scoped to a field (field:word) and ending in * to match
+    every word with that prefix, combined with AND, OR, NOT and parentheses. Words next to
+    each other must all match, as with AND; a quoted "phrase" matches records holding all
+    of its words.
+
+    Attributes:
+        postings    A dict, with field as key ('*' for any field), of dicts of sets of
+                    (alias, id) keys with word as key
+        docs        A dict of the words indexed per field for each record, with (alias, id) as key
+        parents     A dict of parent item ids of pages, with (alias, page id) as key
+        pages       A dict of sets of indexed page ids, with (alias, item id) as key
+    """
+    wordpattern = re.compile(r'\w+', re.UNICODE)
+    querypattern = re.compile(r'\s*(?:(\()|(\))|([^\s()"]+:)?"([^"]*)"|([^\s()"]+))', re.UNICODE)
+
+    def __init__(self):
+        self.postings = {'*': {}}
+        self.docs = {}
+        self.parents = {}
+        self.pages = {}
+        self.sortedterms = {}
+
+    def words(self, value):
+        if not isinstance(value, basestring):
+            return set()
+        return set(self.wordpattern.findall(value.lower()))
+
+    def add(self, obj):
+        """Indexes an item and its pages (those with page metadata), or a Record, replacing
+        any earlier entries for them. An item's pages no longer in it are dropped; a Record
+        holds no pages, so it leaves those of the item alone."""
+        if hasattr(obj, 'pages'):
+            self.removeitem(obj.alias, obj.id)
+        self.addrecord(obj.alias, obj.id, obj.info, getattr(obj, 'dcinfo', None))
+        for p in getattr(obj, 'pages', []):
+            if p is not obj and hasattr(p, 'info'):
+                self.addrecord(p.alias, p.id, p.info, p.dcinfo)
+                self.parents[(p.alias, p.id)] = obj.id
+                self.pages.setdefault((obj.alias, obj.id), set()).add(p.id)
+
+    def addrecord(self, alias, id, info, dcinfo=None):
+        """Indexes one record's info and dcinfo dicts under (alias, id)."""
+        key = (alias, id)
+        self.remove(alias, id)
+        fields = {}
+        for nick, value in (info or {}).iteritems():
+            fields[nick] = self.words(value)
+        for dc, value in (dcinfo or {}).iteritems():
+            fields['dc.' + dc] = self.words(value)
+        everything = set()
+        for field, words in fields.iteritems():
+            postings = self.postings.get(field)
+            if postings is None:
+                postings = self.postings[field] = {}
+            for word in words:
+                postings.setdefault(word, set()).add(key)
+            everything.update(words)
+            self.sortedterms.pop(field, None)
+        for word in everything:
+            self.postings['*'].setdefault(word, set()).add(key)
+        self.sortedterms.pop('*', None)
+        fields['*'] = everything
+        self.docs[key] = fields
+
+    def remove(self, alias, id):
+        """Drops a record (not its pages) from the index."""
+        key = (alias, id)
+        fields = self.docs.pop(key, None)
+        if fields is None:
+            return
+        for field, words in fields.iteritems():
+            postings = self.postings[field]
+            for word in words:
+                keys = postings[word]
+                keys.discard(key)
+                if not keys:
+                    del postings[word]
+                    self.sortedterms.pop(field, None)
+        parent = self.parents.pop(key, None)
+        if parent is not None:
+            pages = self.pages[(alias, parent)]
+            pages.discard(id)
+            if not pages:
+                del self.pages[(alias, parent)]
+
+    def removeitem(self, alias, id):
+        """Drops an item and its pages from the index."""
+        for page in list(self.pages.get((alias, id), ())):
+            self.remove(alias, page)
+        self.remove(alias, id)
+
+    def ingest(self, items):
+        """Generator that indexes items (or Records) as they pass through, skipping ItemErrors,
+        and yields them all on."""
+        for obj in items:
+            if not isinstance(obj, ItemError):
+                self.add(obj)
+            yield obj
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, key):
+        return key in self.docs
+
+    def search(self, query, items=False):
+        """Returns a sorted list of (alias, id) of records matching query (see Index).
+
+        With items=True, pages that match are replaced by their items. An empty query matches
+        nothing; a malformed one raises ValueError."""
+        tokens = []
+        for match in self.querypattern.finditer(query):
+            opening, closing, scope, phrase, word = match.groups()
+            if opening:
+                tokens.append('(')
+            elif closing:
+                tokens.append(')')
+            elif phrase is not None:
+                tokens.append(('phrase', scope[:-1] if scope else '*', phrase))
+            elif word in ('AND', 'OR', 'NOT'):
+                tokens.append(word)
+            elif ':' in word:
+                tokens.append(('word',) + tuple(word.split(':', 1)))
+            else:
+                tokens.append(('word', '*', word))
+        if not tokens:
+            return []
+        keys = IndexQuery(self, tokens, query).parse()
+        if items:
+            keys = set((alias, self.parents.get((alias, id), id)) for alias, id in keys)
+        return sorted(keys, key=lambda key: (key[0], int(key[1]) if key[1].isdigit() else key[1]))
+
+    def match(self, field, kind, text):
+        """Returns the keys of records matching one query word or phrase in field ('*' for any)."""
+        if kind == 'word' and text.endswith('*'):
+            return self.prefix(field, text[:-1].lower())
+        keys = None
+        for word in self.words(text) or [u'']:
+            matches = self.postings.get(field, {}).get(word, set())
+            keys = set(matches) if keys is None else keys & matches
+        return keys
+
+    def prefix(self, field, start):
+        """Returns the keys of records with a word in field starting with start."""
+        terms = self.sortedterms.get(field)
+        postings = self.postings.get(field, {})
+        if terms is None:
+            terms = self.sortedterms[field] = sorted(postings)
+        keys = set()
+        for n in xrange(bisect.bisect_left(terms, start), len(terms)):
+            if not terms[n].startswith(start):
+                break
+            keys.update(postings[terms[n]])
+        return keys
+
+class IndexQuery:
+    """Parses an Index query (with NOT binding tighter than AND, and AND than OR) and
+    evaluates it to a set of (alias, id) keys."""
+    def __init__(self, index, tokens, query):
+        self.index = index
+        self.tokens = tokens
+        self.query = query
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def parse(self):
+        keys = self.parseor()
+        if self.position < len(self.tokens):
+            raise ValueError('Unexpected %r in query: %s' % (self.tokens[self.position], self.query))
+        return keys
+
+    def parseor(self):
+        keys = self.parseand()
+        while self.peek() == 'OR':
+            self.position += 1
+            keys = keys | self.parseand()
+        return keys
+
+    def parseand(self):
+        keys = self.parsenot()
+        while self.peek() not in (None, 'OR', ')'):
+            if self.peek() == 'AND':
+                self.position += 1
+            keys = keys & self.parsenot()
+        return keys
+
+    def parsenot(self):
+        token = self.peek()
+        self.position += 1
+        if token == 'NOT':
+            return set(self.index.docs) - self.parsenot()
+        if token == '(':
+            keys = self.parseor()
+            if self.peek() != ')':
+                raise ValueError('Missing ) in query: ' + self.query)
+            self.position += 1
+            return keys
+        if token is None:
+            raise ValueError('Unexpected end of query: ' + self.query)
+        if not isinstance(token, tuple):
+            raise ValueError('Unexpected %r in query: %s' % (token, self.query))
+        kind, field, text = token
+        return self.index.match(field, kind, text)
+
+class Validator:
+    """Checks item and page metadata against a collection's controlled vocabularies and
+    required fields.
+
+    Each vocabulary is compiled once into a dict of normalized terms (case, accents
+    composed, spacing collapsed) so checking a value is a hash lookup. Values of vocab
+    fields are split on ';' and each term checked; terms that only differ from a
+    vocabulary term by normalization are reported as 'variant', others as 'unknown' with
+    the closest vocabulary terms as suggestions. Required fields (req == 1) left empty
+    are reported as 'missing'.
+
+        validator = pycdm.Validator(leighhunt)
+        report = validator.report(pycdm.items('leighhunt', leighhunt.items, pageinfo='on'))
+        print report
+
+    Attributes:
+        collection  The Collection checked against
+        vocabs      A dict, with field nickname as key, of dicts of vocabulary terms with
+                    normalized term as key
+        required    A list of nicknames of required fields
+        suggestions Max number of suggestions for an unknown term
+        cutoff      How close (0 to 1) a term must be to be suggested
+    """
+    spaces = re.compile(r'\s+', re.UNICODE)
+
+    def __init__(self, collection, fields=None, required=True, suggestions=3, cutoff=0.6):
+        self.collection = collection
+        self.suggestions = suggestions
+        self.cutoff = cutoff
+        self.vocabs = {}
+        self.terms = {}
+        self.suggested = {}
+        for nick, field in collection.fields.items():
+            if fields is not None and nick not in fields:
+                continue
+            if field.vocab == 1 and field.vocabterms:
+                vocab = self.vocabs[nick] = {}
+                for term in field.vocabterms:
+                    vocab.setdefault(self.normalize(term), term)
+                self.terms[nick] = sorted(vocab)
+        self.required = []
+        if required:
+            self.required = sorted(nick for nick, field in collection.fields.items()
+                if field.req == 1 and (fields is None or nick in fields))
+
+    def normalize(self, term):
+        """Returns term in the form terms are compared in."""
+        if not isinstance(term, unicode):
+            term = term.decode('utf-8')
+        return self.spaces.sub(u' ', unicodedata.normalize('NFC', term).lower()).strip()
+
+    def suggest(self, nick, normal):
+        """Returns the vocabulary terms of a field closest to a normalized term (memoized,
+        as the same wrong terms tend to come up again and again)."""
+        key = (nick, normal)
+        found = self.suggested.get(key)
+        if found is None:
+            matches = difflib.get_close_matches(normal, self.terms[nick], self.suggestions, self.cutoff)
+            found = self.suggested[key] = [self.vocabs[nick][m] for m in matches]
+        return found
+
+    def check(self, alias, id, info, partial=False):
+        """Returns a list of Problems in one record's info dict. With partial on (for Records
+        holding just some fields), required fields missing from info aren't reported."""
+        problems = []
+        for nick in self.required:
+            value = info.get(nick)
+            if value is None and partial:
+                continue
+            if not isinstance(value, basestring) or not value.strip():
+                problems.append(Problem(alias, id, nick, 'missing', value))
+        for nick, vocab in self.vocabs.iteritems():
+            value = info.get(nick)
+            if not value or not isinstance(value, basestring):
+                continue
+            for term in value.split(';'):
+                normal = self.normalize(term)
+                if not normal:
+                    continue
+                known = vocab.get(normal)
+                if known is None:
+                    problems.append(Problem(alias, id, nick, 'unknown', term.strip(), self.suggest(nick, normal)))
+                elif known != term.strip():
+                    problems.append(Problem(alias, id, nick, 'variant', term.strip(), [known]))
+        return problems
+
+    def validate(self, objs):
+        """Generator yielding the Problems in items (and their pages with page metadata) or
+        Records, checking them in one pass as they arrive. ItemErrors are skipped."""
+        for obj in objs:
+            if isinstance(obj, ItemError):
+                continue
+            for problem in self.check(obj.alias, obj.id, obj.info, isinstance(obj, Record)):
+                yield problem
+            for p in getattr(obj, 'pages', []):
+                if p is not obj and hasattr(p, 'info'):
+                    for problem in self.check(p.alias, p.id, p.info):
+                        yield problem
+
+    def report(self, objs):
+        """Validates items or Records and returns a ValidationReport."""
+        report = ValidationReport()
+        for obj in objs:
+            if isinstance(obj, ItemError):
+                continue
+            report.records += 1 + len([p for p in getattr(obj, 'pages', []) if p is not obj and hasattr(p, 'info')])
+            for problem in self.validate([obj]):
+                report.add(problem)
+        return report
+
+
+class Problem:
+    """A metadata problem found by a Validator.
+
+    Attributes:
+        alias       The collection alias
+        id          The CDM identifier of the item or page
+        field       The field nickname
+        kind        'unknown' (term not in the vocabulary), 'variant' (term in the vocabulary
+                    in a different case or spacing) or 'missing' (required field empty)
+        value       The term or value found
+        suggestions List of vocabulary terms the value may have meant
+    """
+    def __init__(self, alias, id, field, kind, value, suggestions=None):
+        self.alias = alias
+        self.id = id
+        self.field = field
+        self.kind = kind
+        self.value = value
+        self.suggestions = suggestions or []
+
+    def __repr__(self):
+        return '<pycdm.Problem %s/%s %s %s: %r>' % (self.alias, self.id, self.field, self.kind, self.value)
+
+
+class ValidationReport:
+    """The Problems a Validator found in a set of records.
+
+    Attributes:
+        records     Number of records (items and pages) checked
+        problems    List of Problems
+        counts      A Counter of problems with (field, kind) as key
+        terms       A Counter of unknown terms with (field, term) as key
+    """
+    def __init__(self):
+        self.records = 0
+        self.problems = []
+        self.counts = colls.Counter()
+        self.terms = colls.Counter()
+
+    def add(self, problem):
+        self.problems.append(problem)
+        self.counts[(problem.field, problem.kind)] += 1
+        if problem.kind == 'unknown':
+            self.terms[(problem.field, problem.value)] += 1
+
+    def __len__(self):
+        return len(self.problems)
+
+    def __str__(self):
+        lines = ['%d problems in %d records' % (len(self.problems), self.records)]
+        for (field, kind), count in sorted(self.counts.items()):
+            lines.append('  %s %s: %d' % (field, kind, count))
+        if self.terms:
+            lines.append('Most common unknown terms:')
+        suggestions = {}
+        for p in self.problems:
+            if p.kind == 'unknown':
+                suggestions.setdefault((p.field, p.value), p.suggestions)
+        for (field, term), count in self.terms.most_common(20):
+            hint = suggestions[(field, term)]
+            lines.append(u'  %s %s (%d)%s' % (field, term, count, (u' - did you mean ' + u', '.join(hint) + u'?') if hint else u''))
+        return u'\n'.join(lines).encode('utf-8')
+
+def download(objs, directory, kind='file', workers=None, checksum=False):
+    """Downloads the files (kind='file'), images ('image') or thumbnails ('thumb') of items or
+    pages into directory and returns a list of Download results. See Downloader."""
+    return list(Downloader(directory, kind, workers, checksum).download(objs))
+
+
+class Downloader:
+    """Downloads page files, images or thumbnails to disk, several at a time.
+
+    Files are streamed to disk in chunks, never held in memory whole, and land in
+    directory/alias/. A download is written to a .part file, renamed when complete, so an
+    interrupted run resumes each partial file with an HTTP Range request. Files already
+    downloaded are skipped if the server reports the same size (and, with checksum on,
+    the file still has the SHA-1 recorded in the manifest). Results are kept in
+    directory/manifest.json.
+
+        downloader = pycdm.Downloader('leighhunt-files', workers=4, checksum=True)
+        for result in downloader.download(pycdm.items('leighhunt', leighhunt.items)):
+            if result.status == 'failed':
+                print result.url, result.error
+
+    Attributes:
+        directory   Directory files are saved in
+        kind        'file' (the stored file, fileurl), 'image' (imageurl) or 'thumb' (thumburl)
+        workers     Number of downloads run at once (default maxworkers)
+        checksum    If True, SHA-1 digests are recorded and checked
+        transport   The transport files are fetched with (defaults to the module pool)
+        chunksize   Bytes read and written at a time
+        manifest    A dict of the last result for each file, with path relative to
+                    directory as key
+    """
+    # the Api function each kind of URL comes from, for metrics and rate limits
+    functions = {'file': 'GetFile', 'image': 'GetImage', 'thumb': 'GetThumbnail'}
+
+    def __init__(self, directory, kind='file', workers=None, checksum=False, transport=None, chunksize=65536):
+        if kind not in self.functions:
+            raise RuntimeError('Unknown download kind: ' + kind)
+        self.directory = directory
+        self.kind = kind
+        self.workers = workers or maxworkers
+        self.checksum = checksum
+        self.transport = transport or pool
+        self.chunksize = chunksize
+        self.manifestpath = os.path.join(directory, 'manifest.json')
+        self.manifest = {}
+        if os.path.exists(self.manifestpath):
+            with open(self.manifestpath, 'rb') as f:
+                self.manifest = json.load(f)
+        self.lock = threading.Lock()
+
+    def download(self, objs):
+        """Generator downloading the pages of items (or pages themselves) and yielding a Download
+        for each, in order. ItemErrors are skipped. The manifest is saved when done, or when
+        the caller stops early."""
+        def pages():
+            for obj in objs:
+                if isinstance(obj, ItemError):
+                    continue
+                for p in getattr(obj, 'pages', [obj]):
+                    yield p
+        try:
+            for result in pmap(self.fetch, pages(), self.workers):
+                yield result
+        finally:
+            self.save()
+
+    def target(self, page):
+        """Returns the URL and local path for a page."""
+        if self.kind == 'file':
+            url = page.fileurl
+            name = page.file
+            if name.endswith('.url'):
+                name = os.path.basename(urlparse.urlsplit(url).path) or page.id
+        elif self.kind == 'image':
+            url = page.imageurl
+            name = page.id + '.jpg'
+        else:
+            url = page.thumburl
+            name = page.id + '-thumb.jpg'
+        return url, os.path.join(self.directory, page.alias, name)
+
+    def fetch(self, page):
+        """Downloads one page's file, resuming or skipping it where possible. Returns a Download."""
+        result = Download(page.alias, page.id, None, None)
+        key = None
+        try:
+            result.url, result.path = self.target(page)
+            key = os.path.relpath(result.path, self.directory)
+            with self.lock:
+                entry = self.manifest.get(key)
+            if not self.unchanged(result, entry):
+                self.get(result)
+        except Exception as e:
+            result.status = 'failed'
+            result.error = e
+        if key is None:
+            return result
+        with self.lock:
+            self.manifest[key] = {'alias': result.alias, 'id': result.id, 'url': result.url, 'status': result.status,
+                'size': result.size, 'sha1': result.sha1, 'error': str(result.error) if result.error else None}
+        return result
+
+    def unchanged(self, result, entry):
+        """Returns True (marking result skipped) if the file is already downloaded and unchanged."""
+        if not os.path.exists(result.path):
+            return False
+        size = os.path.getsize(result.path)
+        remote = self.remotesize(result.url)
+        if remote is not None and remote != size:
+            return False
+        if self.checksum:
+            digest = filedigest(result.path)
+            if entry is not None and entry.get('sha1') and entry['sha1'] != digest:
+                return False
+            result.sha1 = digest
+        result.status = 'skipped'
+        result.size = size
+        return True
+
+    def remotesize(self, url):
+        """Returns the size the server reports for url (by a HEAD request), or None if unknown."""
+        # throttled and counted like the download itself
+        function = self.functions[self.kind]
+        limiter = ratelimiter
+        if limiter is not None:
+            limiter.acquire(function)
+        metrics.before(function, url)
+        started = time.time()
+        try:
+            response = self.transport.urlopen(url, method='HEAD')
+            try:
+                response.read()
+                length = response.info().getheader('content-length')
+            finally:
+                response.close()
+        except Exception as e:
+            seconds = time.time() - started
+            if limiter is not None:
+                limiter.release(seconds, getattr(e, 'code', None))
+            metrics.error(function, url, e, seconds)
+            if isinstance(e, urllib2.HTTPError):
+                return None
+            raise
+        seconds = time.time() - started
+        if limiter is not None:
+            limiter.release(seconds)
+        metrics.after(function, url, None, seconds, 0)
+        return int(length) if length else None
+
+    def get(self, result):
+        """Streams result.url to result.path, through a .part file, resuming a partial one."""
+        part = result.path + '.part'
+        folder = os.path.dirname(part)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        function = self.functions[self.kind]
+        limiter = ratelimiter
+        if limiter is not None:
+            limiter.acquire(function)
+        metrics.before(function, result.url)
+        started = time.time()
+        error = None
+        size = 0
+        try:
+            try:
+                response = self.transport.urlopen(result.url, headers={'Range': 'bytes=%d-' % offset} if offset else None)
+            except urllib2.HTTPError as e:
+                if e.code != 416 or not offset:
+                    raise
+                # the partial file is no shorter than the file on the server, so start over
+                offset = 0
+                response = self.transport.urlopen(result.url)
+            try:
+                status = getattr(response, 'status', None) or response.getcode()
+                if status != 206:
+                    offset = 0
+                digest = hashlib.sha1()
+                if offset and self.checksum:
+                    with open(part, 'rb') as f:
+                        for chunk in iter(lambda: f.read(self.chunksize), ''):
+                            digest.update(chunk)
+                with open(part, 'ab' if offset else 'wb') as f:
+                    while True:
+                        chunk = response.read(self.chunksize)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        size += len(chunk)
+                        if self.checksum:
+                            digest.update(chunk)
+            finally:
+                response.close()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            seconds = time.time() - started
+            if limiter is not None:
+                limiter.release(seconds, getattr(error, 'code', None) if error is not None else 200)
+            if error is not None:
+                metrics.error(function, result.url, error, seconds)
+            else:
+                metrics.after(function, result.url, None, seconds, size)
+        if os.name == 'nt' and os.path.exists(result.path):
+            os.remove(result.path)
+        os.rename(part, result.path)
+        result.status = 'resumed' if offset else 'downloaded'
+        result.size = os.path.getsize(result.path)
+        if self.checksum:
+            result.sha1 = digest.hexdigest()
+
+    def save(self):
+        """Writes the manifest, replacing it only once fully written."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        tmp = self.manifestpath + '.tmp'
+        with self.lock:
+            with open(tmp, 'wb') as f:
+                json.dump(self.manifest, f, indent=1, sort_keys=True)
+        if os.name == 'nt' and os.path.exists(self.manifestpath):
+            os.remove(self.manifestpath)
+        os.rename(tmp, self.manifestpath)
+
+
+class Download:
+    """The result of downloading one page's file with a Downloader.
+
+    Attributes:
+        alias       The collection alias
+        id          The CDM identifier of the page
+        url         The URL downloaded
+        path        The local path of the file
+        status      'downloaded', 'resumed' (a partial file was completed), 'skipped'
+                    (already downloaded and unchanged) or 'failed'
+        size        Size of the file in bytes
+        sha1        SHA-1 hex digest of the file (if checksums are on)
+        error       The exception a failed download raised
+    """
+    def __init__(self, alias, id, url, path):
+        self.alias = alias
+        self.id = id
+        self.url = url
+        self.path = path
+        self.status = None
+        self.size = None
+        self.sha1 = None
+        self.error = None
+
+    def __repr__(self):
+        return '<pycdm.Download %s/%s %s>' % (self.alias, self.id, self.status)
+
+def filedigest(path, chunksize=65536):
+    """Returns the SHA-1 hex digest of a file, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def empty_to_str(obj):
     """Converts empty dicts to empty strings."""
     if len(obj) < 1:
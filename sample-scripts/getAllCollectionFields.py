@@ -1,9 +1,9 @@
 #!/usr/bin/python
 
 # getAllCollectionFields.py -- Generates a csv file of all CONTENTdm collection field information.
-# This script uses the CONTENTdm API to pull the list of all collections, then iterates through
-# each collection, outputting a collection field per rown, including field label, field nickname,
-# corresponding DC field, and other field properties. Outputs a csv file.
+# This script uses the CONTENTdm API to pull the list of all collections, then loads
+# the collections several at a time, outputting a collection field per row, including field label,
+# field nickname, corresponding DC field, and other field properties. Outputs a csv file.
 
 import pycdm
 import datetime
@@ -21,11 +21,14 @@ call = pycdm.Api()
 
 #get list of all collections
 collectionslist = call.dmGetCollectionList()
+aliases = [c['alias'].lstrip('/') for c in collectionslist]
+
+#load all collections, 4 at a time. Vocabularies aren't written, so don't fetch them
+colls = pycdm.loadcollections(aliases, workers=4, vocab='lazy')
 
 #iterate through collection list, writing field data to csv for each collection field
-for c in collectionslist:
-    coll = pycdm.Collection(c['alias'].lstrip('/'))
-    alias = coll.alias
+for alias in aliases:
+    coll = colls[alias]
     for k, v in coll.fields.items():
         nick = v.nick
         label = v.name
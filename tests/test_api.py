@@ -0,0 +1,98 @@
+# Tests for Api request merging, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import threading
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=5, pages=2, latency=0.2)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def concurrently(self, func, n=5):
+        results = [None] * n
+        def run(i):
+            results[i] = func()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_identical_calls_send_one_request(self):
+        results = self.concurrently(lambda: pycdm.Api().dmGetItemInfo(ALIAS, '1'))
+        self.assertEqual(self.server.stats['dmGetItemInfo'], 1)
+        self.assertEqual(results, [results[0]] * len(results))
+
+    def test_merged_callers_get_their_own_objects(self):
+        results = self.concurrently(lambda: pycdm.Api().dmGetItemInfo(ALIAS, '1'))
+        self.assertEqual(len(set(id(r) for r in results)), len(results))
+        results[0]['title'] = u'Changed'
+        self.assertNotEqual(results[1]['title'], u'Changed')
+
+    def test_flights_off_sends_every_request(self):
+        self.concurrently(lambda: pycdm.Api(flights=False).dmGetItemInfo(ALIAS, '1'))
+        self.assertEqual(self.server.stats['dmGetItemInfo'], 5)
+
+
+class AsyncApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=5, pages=2)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        self.call = None
+
+    def tearDown(self):
+        if self.call is not None:
+            self.call.close()
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_settings_passed_to_api(self):
+        metrics = pycdm.Metrics()
+        limiter = pycdm.RateLimiter(concurrency=2)
+        self.call = pycdm.AsyncApi(workers=2, cache=False, metrics=metrics, limiter=limiter, flights=False)
+        self.assertEqual((self.call.api.cache, self.call.api.metrics, self.call.api.limiter, self.call.api.flights),
+            (None, metrics, limiter, None))
+        self.assertEqual(self.call.dmGetItemInfo(ALIAS, '1').get()['dmrecord'], '1')
+        self.assertEqual(metrics.endpoints['dmGetItemInfo'].calls, 1)
+
+    def test_item_keywords(self):
+        self.call = pycdm.AsyncApi(workers=2)
+        obj = self.call.item(ALIAS, '1', toplevel=True, find='1.jpg').get()
+        self.assertTrue(isinstance(obj, pycdm.SinglePageItem))
+        self.assertEqual(self.server.stats.get('GetParent', 0), 0)
+        self.assertEqual(self.server.stats.get('dmGetCompoundObjectInfo', 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
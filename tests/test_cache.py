@@ -0,0 +1,124 @@
+# Tests for ResponseCache invalidation by dmmodified, run against the mock server in
+# benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=10, pages=5)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        self.directory = tempfile.mkdtemp()
+        store = self.server.store
+        self.id = [id for id in store.collections[ALIAS]['ids'] if (ALIAS, id) in store.compound
+                   and store.compound[(ALIAS, id)]['type'] == 'Document'][0]
+
+    def tearDown(self):
+        pycdm.responsecache.close()
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def cache(self, **kwds):
+        pycdm.responsecache = pycdm.ResponseCache(os.path.join(self.directory, 'cache.db'), **kwds)
+
+    def change(self, modified):
+        """Drops the Document's last two pages on the server and sets its dmmodified."""
+        key = (ALIAS, self.id)
+        self.server.store.records[key] = dict(self.server.store.records[key], dmmodified=modified)
+        self.server.store.compound[key]['page'] = self.server.store.compound[key]['page'][:3]
+
+    def pages(self, **kwds):
+        return len(pycdm.item(ALIAS, str(self.id), **kwds).pages)
+
+    def test_query_drops_changed_item_without_cached_info(self):
+        self.cache(ttls={'dmGetItemInfo': 0})
+        self.assertEqual(self.pages(), 5)
+        self.change(u'2015-01-01')
+        list(pycdm.collections.load(ALIAS).querypages())
+        self.assertEqual(self.pages(), 3)
+
+    def test_item_checks_known_modified(self):
+        self.cache()
+        self.assertEqual(self.pages(), 5)
+        self.change(u'2015-01-01')
+        self.assertEqual(self.pages(modified=u'2015-01-01'), 3)
+
+    def test_items_check_records_modified(self):
+        self.cache()
+        self.assertEqual(self.pages(), 5)
+        self.change(u'2015-01-01')
+        built = pycdm.items(ALIAS, [str(self.id)], modified={str(self.id): u'2015-01-01'})
+        self.assertEqual(len(list(built)[0].pages), 3)
+
+    def test_item_fetches_info_before_cached_structure(self):
+        self.cache(ttls={'dmGetItemInfo': 0})
+        self.assertEqual(self.pages(), 5)
+        self.change(u'2015-01-01')
+        obj = pycdm.item(ALIAS, str(self.id))
+        self.assertEqual(obj.info['dmmodified'], u'2015-01-01')
+        self.assertEqual(len(obj.pages), 3)
+
+    def test_responses_older_than_modified_dropped(self):
+        # cached before any dmmodified was seen for the item, on the day it changed
+        self.cache(ttls={'dmGetItemInfo': 0})
+        pycdm.Api().dmGetCompoundObjectInfo(ALIAS, str(self.id))
+        self.change(unicode(time.strftime('%Y-%m-%d')))
+        pycdm.Api().dmGetItemInfo(ALIAS, str(self.id))
+        self.assertEqual(self.pages(), 3)
+
+    def test_responses_newer_than_modified_kept(self):
+        self.cache(ttls={'dmGetItemInfo': 0})
+        pycdm.Api().dmGetCompoundObjectInfo(ALIAS, str(self.id))
+        pycdm.Api().dmGetItemInfo(ALIAS, str(self.id))
+        self.assertTrue(pycdm.responsecache.get(pycdm.Api().base + '/dmwebservices/index.php?q='
+            'dmGetCompoundObjectInfo/%s/%d/json' % (ALIAS, self.id)))
+
+
+    def accessed(self, url):
+        return pycdm.responsecache.db.execute('SELECT accessed FROM responses WHERE url = ?', (url,)).fetchone()[0]
+
+    def test_hits_update_access_time_only_when_stale(self):
+        self.cache()
+        api = pycdm.Api()
+        api.dmGetItemInfo(ALIAS, str(self.id))
+        url = api.base + '/dmwebservices/index.php?q=dmGetItemInfo/%s/%d/json' % (ALIAS, self.id)
+        first = self.accessed(url)
+        self.assertTrue(pycdm.responsecache.get(url))
+        self.assertEqual(self.accessed(url), first)
+        pycdm.responsecache.touch = 0
+        time.sleep(0.01)
+        self.assertTrue(pycdm.responsecache.get(url))
+        self.assertTrue(self.accessed(url) > first)
+
+    def test_fetchedafter(self):
+        self.cache()
+        day = 1420070400  # 2015-01-01 00:00 UTC
+        self.assertFalse(pycdm.fetchedafter(day + 2 * 86400 - 1, '2015-01-01'))
+        self.assertTrue(pycdm.fetchedafter(day + 2 * 86400, '2015-01-01'))
+        self.assertFalse(pycdm.fetchedafter(day + 10 * 86400, 'unknown'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Tests for incremental harvesting with changes() and Checkpoint, run against the mock
+# server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class ChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=10, pages=3)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def pending(self):
+        return len(pycdm.changes(ALIAS, pycdm.Checkpoint(self.path, ALIAS)))
+
+    def test_commit_after_full_harvest(self):
+        found = pycdm.changes(ALIAS, pycdm.Checkpoint(self.path, ALIAS))
+        self.assertEqual(len(found), 10)
+        for obj in found.items():
+            self.assertFalse(isinstance(obj, pycdm.ItemError))
+        found.commit()
+        self.assertEqual(self.pending(), 0)
+
+    def test_commit_keeps_items_not_harvested(self):
+        found = pycdm.changes(ALIAS, pycdm.Checkpoint(self.path, ALIAS))
+        for obj in found.items():
+            break
+        found.commit()
+        self.assertEqual(self.pending(), 9)
+
+    def test_commit_without_harvest(self):
+        pycdm.changes(ALIAS, pycdm.Checkpoint(self.path, ALIAS)).commit()
+        self.assertEqual(self.pending(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# Tests for the Downloader, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=10, pages=3)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache, pycdm.ratelimiter
+        pycdm.base = 'http://127.0.0.1:%d' % self.server.server_port
+        pycdm.port = ''
+        pycdm.responsecache = None
+        self.directory = tempfile.mkdtemp()
+        ids = [str(id) for id in self.server.store.collections[ALIAS]['ids']]
+        self.items = list(pycdm.items(ALIAS, ids))
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache, pycdm.ratelimiter = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_rerun_checks_are_throttled_and_counted(self):
+        files = [r.status for r in pycdm.download(self.items, self.directory)]
+        self.assertEqual(set(files), set(['downloaded']))
+        pycdm.ratelimiter = pycdm.RateLimiter(concurrency=1)
+        acquired = []
+        acquire = pycdm.ratelimiter.acquire
+        pycdm.ratelimiter.acquire = lambda function: (acquired.append(function), acquire(function))
+        with pycdm.profile() as stats:
+            skipped = [r.status for r in pycdm.download(self.items, self.directory)]
+        self.assertEqual(set(skipped), set(['skipped']))
+        self.assertEqual(acquired, ['GetFile'] * len(files))
+        self.assertEqual(stats.endpoints['GetFile'].calls, len(files))
+        self.assertEqual(pycdm.ratelimiter.inflight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Tests for export() to CSV and JSON Lines, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import csv
+import gzip
+import json
+import collections
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=12, pages=3)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        self.directory = tempfile.mkdtemp()
+        ids = [str(id) for id in self.server.store.collections[ALIAS]['ids']]
+        self.items = list(pycdm.items(ALIAS, ids, pageinfo='on'))
+        self.fields = sorted(pycdm.collections.load(ALIAS).fields)
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def readcsv(self, f):
+        return [[v.decode('utf-8') for v in row] for row in csv.reader(f)]
+
+    def test_csv_items(self):
+        rows = pycdm.export(self.items, self.path('items.csv'), buffersize=100)
+        self.assertEqual(rows, len(self.items))
+        with open(self.path('items.csv'), 'rb') as f:
+            read = self.readcsv(f)
+        self.assertEqual(read[0], ['alias', 'id'] + self.fields)
+        for row, obj in zip(read[1:], self.items):
+            self.assertEqual(row, [obj.alias, obj.id] + [obj.info.get(f, '') for f in self.fields])
+
+    def test_csv_pages_compressed(self):
+        rows = pycdm.export(self.items, self.path('pages.csv.gz'), level='page', compress=True)
+        pages = [(obj, p) for obj in self.items for p in obj.pages]
+        self.assertEqual(rows, len(pages))
+        with gzip.open(self.path('pages.csv.gz'), 'rb') as f:
+            read = self.readcsv(f)
+        self.assertEqual(read[0], ['alias', 'itemid', 'id', 'label', 'file'] + self.fields)
+        for row, (obj, p) in zip(read[1:], pages):
+            info = getattr(p, 'info', {})
+            self.assertEqual(row, [obj.alias, obj.id, p.id, p.label, p.file] + [info.get(f, '') for f in self.fields])
+
+    def test_jsonl_dc(self):
+        fields = ['title', 'subjec']
+        pycdm.export(self.items, self.path('dc.jsonl'), level='dc', format='jsonl', fields=fields)
+        with open(self.path('dc.jsonl'), 'rb') as f:
+            read = [json.loads(line, object_pairs_hook=collections.OrderedDict) for line in f]
+        self.assertEqual(len(read), len(self.items))
+        for record, obj in zip(read, self.items):
+            self.assertEqual(record.keys(), ['alias', 'id'] + fields)
+            self.assertEqual(record, dict([('alias', obj.alias), ('id', obj.id)] +
+                [(f, obj.dcinfo.get(f, '')) for f in fields]))
+
+    def test_skips_item_errors(self):
+        objs = self.items[:2] + [pycdm.ItemError(ALIAS, '999', RuntimeError('gone'), '')]
+        self.assertEqual(pycdm.export(objs, self.path('some.jsonl'), format='jsonl'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
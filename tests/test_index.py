@@ -0,0 +1,75 @@
+# Tests for the local Index, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=10, pages=3)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        store = self.server.store
+        id = [id for id in store.collections[ALIAS]['ids'] if (ALIAS, id) in store.compound
+              and store.compound[(ALIAS, id)]['type'] == 'Document'][0]
+        self.obj = pycdm.item(ALIAS, str(id), pageinfo='on')
+        self.index = pycdm.Index()
+        self.index.add(self.obj)
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_readding_drops_removed_pages(self):
+        page = self.obj.pages.pop()
+        self.index.add(self.obj)
+        self.assertFalse((ALIAS, page.id) in self.index)
+        self.assertEqual(self.index.search('title:"page 3"'), [])
+        self.assertEqual(self.index.search('title:"page 3"', items=True), [])
+        self.assertEqual(self.index.pages[(ALIAS, self.obj.id)], set(p.id for p in self.obj.pages))
+
+    def test_record_keeps_pages(self):
+        record = pycdm.Record(ALIAS, self.obj.id, '', self.obj.info)
+        self.index.add(record)
+        self.assertEqual(len(self.index), 1 + len(self.obj.pages))
+        self.assertEqual(self.index.search('title:page', items=True), [(ALIAS, self.obj.id)])
+
+    def test_removeitem(self):
+        self.index.removeitem(ALIAS, self.obj.id)
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.parents, {})
+        self.assertEqual(self.index.pages, {})
+
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.search(''), [])
+        self.assertEqual(self.index.search('   '), [])
+
+    def test_malformed_queries(self):
+        for query in ('title:page AND', 'NOT', '(title:page', 'title:page )'):
+            self.assertRaises(ValueError, self.index.search, query)
+        try:
+            self.index.search('title:page OR')
+        except ValueError as e:
+            self.assertTrue(str(e).startswith('Unexpected end of query'), str(e))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# Tests for TokenBucket and RateLimiter, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import time
+import urllib2
+import threading
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = pycdm.TokenBucket(50, burst=1)
+        started = time.time()
+        for n in range(11):
+            bucket.take()
+        # the first token is in the bucket, the other ten come at 50 a second
+        self.assertAlmostEqual(time.time() - started, 0.2, delta=0.05)
+
+    def test_burst(self):
+        bucket = pycdm.TokenBucket(1, burst=5)
+        started = time.time()
+        for n in range(5):
+            bucket.take()
+        self.assertTrue(time.time() - started < 0.05)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_concurrency(self):
+        limiter = pycdm.RateLimiter(concurrency=2)
+        running = []
+        peak = []
+        lock = threading.Lock()
+        def request():
+            limiter.acquire('dmGetItemInfo')
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            limiter.release(0.02)
+        threads = [threading.Thread(target=request) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(limiter.inflight, 0)
+
+    def test_function_rate(self):
+        limiter = pycdm.RateLimiter(rates={'dmQuery': 20})
+        started = time.time()
+        for n in range(30):
+            limiter.acquire('dmGetItemInfo')
+            limiter.release(0)
+        self.assertTrue(time.time() - started < 0.05)
+        started = time.time()
+        for n in range(30):
+            limiter.acquire('dmQuery')
+            limiter.release(0)
+        # a burst of 20, then ten more at 20 a second
+        self.assertAlmostEqual(time.time() - started, 0.5, delta=0.1)
+
+    def test_backoff_on_server_errors(self):
+        limiter = pycdm.RateLimiter(concurrency=16, adaptive=True, minconcurrency=2)
+        limiter.acquire('dmGetItemInfo')
+        limiter.release(0.01, 503)
+        self.assertEqual(limiter.concurrency, 8)
+        # errors reported by requests in flight at the same time only cut once per round trip
+        limiter.latency = 1.0
+        limiter.acquire('dmGetItemInfo')
+        limiter.release(0.01, 503)
+        self.assertEqual(limiter.concurrency, 8)
+        limiter.latency = 0
+        for n in range(5):
+            limiter.lastcut = 0
+            limiter.acquire('dmGetItemInfo')
+            limiter.release(0.01, None)
+        self.assertEqual(limiter.concurrency, 2)
+
+    def test_ramps_up_while_healthy(self):
+        limiter = pycdm.RateLimiter(concurrency=2, adaptive=True, maxconcurrency=3)
+        for n in range(10):
+            limiter.acquire('dmGetItemInfo')
+            limiter.release(0.01)
+        self.assertEqual(limiter.concurrency, 3)
+
+    def test_backoff_on_mock_server_errors(self):
+        server = mockcdm.serve(items=5, pages=2, errors=1.0)
+        try:
+            limiter = pycdm.RateLimiter(concurrency=8, adaptive=True)
+            api = pycdm.Api('http://127.0.0.1', ':%d' % server.server_port, cache=False, limiter=limiter,
+                flights=False)
+            self.assertRaises(urllib2.HTTPError, api.dmGetItemInfo, ALIAS, '1')
+            self.assertEqual(limiter.concurrency, 4)
+            self.assertEqual(limiter.inflight, 0)
+        finally:
+            pycdm.pool.close()
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Tests for unescaping and Dublin Core mapping of metadata, run against the mock server in
+# benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import json
+import unittest
+from HTMLParser import HTMLParser
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+VALUES = [
+    u'', u'plain text', u'Caf&eacute; menus', u'&amp;&lt;&gt;&quot;&#39;', u'&#233;t&#xE9; &#XE9;',
+    u'&copy; 1850 &nbsp;x', u'&unknown; & &; &#; &#x; &amp', u'a &amp;amp; b', u'&#65;&#x42;&#x43',
+    u'&AElig;&aelig;&Omega;', u'&#9731; snow', u'semi;colons &amp; more;',
+]
+
+
+def olddcinfo(dcmap, info):
+    """dcinfo() as it was before todcbatch()."""
+    dc = {}
+    for key, value in info.items():
+        if key in dcmap.keys():
+            dcfield = dcmap[key]
+            if dcfield not in dc.keys():
+                dc[dcfield] = []
+            for v in value.split(';'):
+                if (v != '') and (v != ';'):
+                    dc[dcfield].append(v.strip(';'))
+    for key, value in dc.items():
+        if len(value) > 1:
+            dc[key] = ';'.join(value)
+        elif len(value) == 1:
+            dc[key] = value[0]
+        else:
+            dc[key] = ''
+    return dc
+
+
+class UnescapeTest(unittest.TestCase):
+
+    def test_same_as_htmlparser(self):
+        parser = HTMLParser()
+        for value in VALUES:
+            self.assertEqual(pycdm.unescape(value), parser.unescape(value), value)
+            # again, from the memo
+            self.assertEqual(pycdm.unescape(value), parser.unescape(value), value)
+
+    def test_htmlunescape(self):
+        info = dict(('f%d' % n, v) for n, v in enumerate(VALUES))
+        unescaped = pycdm.htmlunescape(info)
+        self.assertFalse(unescaped is info)
+        self.assertEqual(unescaped, dict((k, HTMLParser().unescape(v)) for k, v in info.items()))
+
+
+class DublinCoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=30, pages=2)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_todcbatch_same_as_dcinfo(self):
+        collection = pycdm.collections.load(ALIAS)
+        # as decoded from dmGetItemInfo responses
+        infos = [pycdm.htmlunescape(json.loads(json.dumps(r), object_hook=pycdm.empty_to_str))
+                 for key, r in sorted(self.server.store.records.items())]
+        infos.append({'title': u';A;;B;', 'creato': u'', 'subjec': u';', 'descri': u'x'})
+        # two fields mapped to one DC field
+        collection.dcmap['descri'] = 'creato'
+        for info, dc in zip(infos, collection.todcbatch(infos)):
+            self.assertEqual(dc, olddcinfo(collection.dcmap, info))
+            self.assertEqual(dc, pycdm.dcinfo(ALIAS, info))
+
+
+if __name__ == '__main__':
+    unittest.main()
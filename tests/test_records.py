@@ -0,0 +1,64 @@
+# Tests for Collection.records(), run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+FIELDS = ['title', 'creato', 'subjec', 'type', 'descri', 'transc', 'rights', 'dmmodified']
+
+
+class RecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=30, pages=2)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_more_fields_than_one_query(self):
+        self.assertTrue(len(FIELDS) > pycdm.maxqueryfields)
+        collection = pycdm.collections.load(ALIAS)
+        records = list(collection.records(FIELDS, pagesize=7))
+        ids = self.server.store.collections[ALIAS]['ids']
+        self.assertEqual([r.id for r in records], [str(id) for id in ids])
+        for r in records:
+            stored = self.server.store.records[(ALIAS, int(r.id))]
+            self.assertEqual(r.info['dmmodified'], stored['dmmodified'])
+            self.assertEqual(r.info['title'], pycdm.unescape(stored['title']))
+            self.assertEqual(r.dcinfo, collection.todc(r.info))
+
+    def test_items_deleted_between_queries(self):
+        collection = pycdm.collections.load(ALIAS)
+        ids = self.server.store.collections[ALIAS]['ids']
+        queried = []
+        def delete(function, url):
+            if function == 'dmQuery':
+                queried.append(url)
+                if len(queried) == 2:
+                    del ids[0]
+        pycdm.metrics.addhook('before', delete)
+        try:
+            self.assertRaises(RuntimeError, list, collection.records(FIELDS, pagesize=7, prefetch=False))
+        finally:
+            pycdm.metrics.removehook('before', delete)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Tests for CollectionRegistry, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(collections=3, items=5, pages=2, latency=0.05)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved[:3]
+        if len(self.saved) > 3:
+            pycdm.inflight = self.saved[3]
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def builds(self):
+        return self.server.stats.get('dmGetCollectionParameters', 0)
+
+    def test_ttl(self):
+        registry = pycdm.CollectionRegistry(ttl=0.2)
+        first = registry.load('coll0')
+        self.assertTrue(registry.load('coll0') is first)
+        self.assertTrue('coll0' in registry)
+        time.sleep(0.3)
+        self.assertFalse('coll0' in registry)
+        self.assertRaises(KeyError, registry.__getitem__, 'coll0')
+        self.assertFalse(registry.load('coll0') is first)
+        self.assertEqual(self.builds(), 2)
+
+    def test_lru(self):
+        registry = pycdm.CollectionRegistry(maxsize=2)
+        registry.load('coll0')
+        registry.load('coll1')
+        registry.load('coll0')
+        registry.load('coll2')
+        self.assertEqual(sorted(registry.keys()), ['coll0', 'coll2'])
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(self.builds(), 3)
+
+    def test_concurrent_loads_build_once(self):
+        registry = pycdm.CollectionRegistry()
+        # without request merging, so only the registry can keep the calls to one
+        self.saved += (pycdm.inflight,)
+        pycdm.inflight = None
+        loaded = []
+        threads = [threading.Thread(target=lambda: loaded.append(registry.load('coll1'))) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(loaded), 6)
+        self.assertTrue(all(c is loaded[0] for c in loaded))
+        self.assertEqual(self.builds(), 1)
+
+    def test_invalidate(self):
+        registry = pycdm.CollectionRegistry()
+        registry.load('coll0')
+        registry.invalidate('coll0')
+        self.assertFalse('coll0' in registry)
+        registry.load('coll0')
+        self.assertEqual(self.builds(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# Tests for savesnapshot() and Snapshot, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=15, pages=4, depth=3)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'coll0.snap')
+        ids = [str(id) for id in self.server.store.collections[ALIAS]['ids']]
+        self.items = list(pycdm.items(ALIAS, ids, pageinfo='on'))
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def roundtrip(self, compress):
+        self.assertEqual(pycdm.savesnapshot(self.items, self.filename, compress=compress), len(self.items))
+        requests = self.server.stats['requests']
+        with pycdm.Snapshot(self.filename) as snap:
+            self.assertEqual(snap.ids, [obj.id for obj in self.items])
+            self.assertEqual(len(snap), len(self.items))
+            loaded = list(snap)
+            self.assertEqual(snap[self.items[6].id].id, self.items[6].id)
+            self.assertEqual(sorted(snap.collection.fields), sorted(self.items[0].collection.fields))
+        self.assertEqual(self.server.stats['requests'], requests)
+        kinds = set()
+        for original, obj in zip(self.items, loaded):
+            kinds.add(obj.__class__)
+            self.assertEqual(obj.__class__, original.__class__)
+            self.assertEqual(pycdm.packitem(obj), pycdm.packitem(original))
+            self.assertEqual([(p.id, p.info) for p in obj.pages], [(p.id, p.info) for p in original.pages])
+        self.assertEqual(kinds, set([pycdm.SinglePageItem, pycdm.Document, pycdm.Monograph]))
+
+    def test_roundtrip(self):
+        self.roundtrip(False)
+
+    def test_roundtrip_compressed(self):
+        self.roundtrip(True)
+
+    def test_rejects_other_versions(self):
+        pycdm.savesnapshot(self.items[:2], self.filename)
+        with open(self.filename, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('>H', pycdm.snapshotversion + 1))
+        self.assertRaises(RuntimeError, pycdm.Snapshot, self.filename)
+
+    def test_rejects_other_files(self):
+        with open(self.filename, 'wb') as f:
+            f.write('not a snapshot at all')
+        self.assertRaises(RuntimeError, pycdm.Snapshot, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
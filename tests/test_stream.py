@@ -0,0 +1,77 @@
+# Tests for streamed Api responses, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import threading
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+def finishes(func, seconds=10):
+    """Runs func in a thread and returns whether it finished within seconds."""
+    thread = threading.Thread(target=func)
+    thread.daemon = True
+    thread.start()
+    thread.join(seconds)
+    return not thread.is_alive()
+
+
+class StreamLimiterTest(unittest.TestCase):
+    """A caller making requests while it reads a streamed response must not wait on itself
+    for a RateLimiter slot."""
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=20, pages=5)
+        self.saved = pycdm.base, pycdm.port, pycdm.ratelimiter, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        pycdm.ratelimiter = pycdm.RateLimiter(concurrency=1)
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.ratelimiter, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_items_while_streaming_ids(self):
+        built = []
+        def harvest():
+            for alias, id in pycdm.collections.load(ALIAS).iter_items(prefetch=False):
+                built.append(pycdm.item(alias, id))
+        self.assertTrue(finishes(harvest), 'blocked after %d items' % len(built))
+        self.assertEqual(len(built), len(self.server.store.collections[ALIAS]['ids']))
+        self.assertEqual(pycdm.ratelimiter.inflight, 0)
+
+    def test_calls_while_streaming_pages(self):
+        store = self.server.store
+        id = [id for id in store.collections[ALIAS]['ids'] if (ALIAS, id) in store.compound][0]
+        infos = []
+        def walk():
+            api = pycdm.Api()
+            for titles, page in api.dmGetCompoundObjectPages(ALIAS, str(id)):
+                infos.append(api.dmGetItemInfo(ALIAS, page['pageptr']))
+        self.assertTrue(finishes(walk), 'blocked after %d pages' % len(infos))
+        self.assertTrue(infos)
+        self.assertEqual(pycdm.ratelimiter.inflight, 0)
+
+    def test_stopping_early_frees_slot(self):
+        records = pycdm.Api().dmQuery('0', alias=ALIAS, fields='dmmodified', maxrecs='100', ret='records')
+        for r in records:
+            break
+        self.assertEqual(pycdm.ratelimiter.inflight, 0)
+        self.assertTrue(finishes(lambda: pycdm.Api().dmGetItemInfo(ALIAS, str(r['pointer']))))
+
+
+if __name__ == '__main__':
+    unittest.main()
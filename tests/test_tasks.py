@@ -0,0 +1,84 @@
+# Tests for the thread helpers spawn(), Task and pmap():
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import time
+import itertools
+import signal
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pycdm
+
+
+class TaskTest(unittest.TestCase):
+
+    def elapsed(self, func):
+        started = time.time()
+        func()
+        return time.time() - started
+
+    def test_get_returns_promptly_in_main_thread(self):
+        self.assertEqual(threading.current_thread().name, 'MainThread')
+        seconds = self.elapsed(lambda: [pycdm.spawn(time.sleep, 0.02).get() for n in range(10)])
+        # a polling wait added 10 ms or more to each call
+        self.assertTrue(seconds < 0.25, seconds)
+        self.assertEqual(pycdm.wakeup[0], os.getpid())
+
+    def test_get_returns_promptly_in_other_threads(self):
+        times = []
+        thread = threading.Thread(target=lambda: times.append(self.elapsed(
+            lambda: [pycdm.spawn(time.sleep, 0.02).get() for n in range(10)])))
+        thread.start()
+        thread.join()
+        self.assertTrue(times[0] < 0.25, times[0])
+
+    def test_get_raises_error(self):
+        self.assertRaises(ZeroDivisionError, pycdm.spawn(lambda: 1 / 0).get)
+
+    def test_ctrl_c_interrupts_get(self):
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGINT))
+        timer.start()
+        self.assertRaises(KeyboardInterrupt, pycdm.spawn(time.sleep, 5).get)
+
+
+class PmapTest(unittest.TestCase):
+
+    def test_keeps_order(self):
+        def slow(n):
+            time.sleep((n % 3) * 0.01)
+            return n * 2
+        self.assertEqual(list(pycdm.pmap(slow, xrange(50), workers=4)), [n * 2 for n in range(50)])
+
+    def test_single_worker(self):
+        self.assertEqual(list(pycdm.pmap(str, range(5), workers=1)), ['0', '1', '2', '3', '4'])
+
+    def test_passes_errors_through(self):
+        def fail(n):
+            if n == 3:
+                raise ValueError(n)
+            return n
+        results = pycdm.pmap(fail, range(10), workers=4)
+        self.assertEqual([results.next() for n in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, results.next)
+
+    def test_reads_input_lazily(self):
+        read = []
+        def source():
+            for n in itertools.count():
+                read.append(n)
+                yield n
+        results = pycdm.pmap(lambda n: n, source(), workers=2)
+        self.assertEqual(results.next(), 0)
+        results.close()
+        self.assertTrue(len(read) <= 2 * 2 + 1, len(read))
+
+
+import itertools
+
+
+if __name__ == '__main__':
+    unittest.main()
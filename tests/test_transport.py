@@ -0,0 +1,104 @@
+# Tests for the ConnectionPool transport, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=5, pages=2, latency=0.3)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = pycdm.ConnectionPool(timeout=0.1)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_timeout_not_retried(self):
+        # _stats is answered without latency, leaving a connection in the pool
+        self.pool.urlopen(self.url + '/_stats').read()
+        self.assertRaises(socket.timeout, self.pool.urlopen,
+            self.url + '/dmwebservices/index.php?q=dmGetItemInfo/%s/1/json' % ALIAS)
+        time.sleep(0.8)
+        self.assertEqual(self.server.stats['dmGetItemInfo'], 1)
+
+    def test_reuses_connections(self):
+        self.pool.timeout = 5
+        first = self.pool.urlopen(self.url + '/_stats')
+        first.read()
+        conn = self.pool.pools[('http', '127.0.0.1:%d' % self.server.server_port)].queue[0]
+        sock = conn.sock
+        second = self.pool.urlopen(self.url + '/_stats')
+        second.read()
+        self.assertTrue(conn.sock is sock)
+        self.assertEqual(self.pool.pools[('http', '127.0.0.1:%d' % self.server.server_port)].qsize(), 1)
+
+
+class DroppingServer:
+    """Answers each connection's first request, then closes it, as a server dropping idle
+    keep-alive connections does."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.connections = 0
+        self.dropped = threading.Event()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn = self.listener.accept()[0]
+            except socket.error:
+                return
+            self.connections += 1
+            request = ''
+            while '\r\n\r\n' not in request:
+                request += conn.recv(4096)
+            conn.sendall('HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            conn.close()
+            self.dropped.set()
+
+    def close(self):
+        self.listener.close()
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_retries_dropped_connection(self):
+        server = DroppingServer()
+        pool = pycdm.ConnectionPool()
+        try:
+            url = 'http://127.0.0.1:%d/' % server.port
+            self.assertEqual(pool.urlopen(url).read(), 'ok')
+            server.dropped.wait(5)
+            time.sleep(0.05)
+            self.assertEqual(pool.urlopen(url).read(), 'ok')
+            self.assertEqual(server.connections, 2)
+        finally:
+            pool.close()
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Tests for Validator, run against the mock server in benchmarks/mockcdm.py:
+#
+#   $ python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+import pycdm
+import mockcdm
+
+ALIAS = 'coll0'
+
+
+class ValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockcdm.serve(items=10, pages=2)
+        self.saved = pycdm.base, pycdm.port, pycdm.responsecache
+        pycdm.base = 'http://127.0.0.1'
+        pycdm.port = ':%d' % self.server.server_port
+        pycdm.responsecache = None
+        self.validator = pycdm.Validator(pycdm.collections.load(ALIAS))
+
+    def tearDown(self):
+        pycdm.base, pycdm.port, pycdm.responsecache = self.saved
+        pycdm.collections.clear()
+        pycdm.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def problems(self, info, partial=False):
+        return [(p.field, p.kind, p.value, p.suggestions) for p in self.validator.check(ALIAS, '1', info, partial)]
+
+    def test_compiled_vocabularies_and_required(self):
+        self.assertEqual(sorted(self.validator.vocabs), ['subjec', 'type'])
+        self.assertEqual(self.validator.required, ['rights', 'title'])
+
+    def test_clean_items(self):
+        ids = [str(id) for id in self.server.store.collections[ALIAS]['ids']]
+        # the mock's type values aren't in its vocabulary, so only its other fields are clean
+        validator = pycdm.Validator(pycdm.collections.load(ALIAS), fields=['title', 'rights', 'subjec'])
+        report = validator.report(pycdm.items(ALIAS, ids, pageinfo='on'))
+        self.assertEqual(report.problems, [])
+        self.assertEqual(report.records, len(self.server.store.records))
+
+    def test_unknown(self):
+        info = {'title': u'A letter', 'rights': u'Public domain', 'subjec': u'Letters;Leters'}
+        self.assertEqual(self.problems(info), [('subjec', 'unknown', u'Leters', [u'Letters'])])
+
+    def test_variant(self):
+        info = {'title': u'A letter', 'rights': u'Public domain', 'subjec': u' letters ;Caf\xe9  MENUS'}
+        self.assertEqual(self.problems(info), [('subjec', 'variant', u'letters', [u'Letters']),
+            ('subjec', 'variant', u'Caf\xe9  MENUS', [u'Caf\xe9 menus'])])
+
+    def test_missing_required(self):
+        info = {'title': u'  ', 'subjec': u'Letters'}
+        self.assertEqual(sorted(self.problems(info)), [('rights', 'missing', None, []), ('title', 'missing', u'  ', [])])
+        # Records hold only some fields, so fields they don't hold aren't missing
+        self.assertEqual(self.problems(info, partial=True), [('title', 'missing', u'  ', [])])
+
+    def test_report_counts(self):
+        records = [pycdm.Record(ALIAS, str(n), '', {'title': u'', 'subjec': u'Leters'}) for n in range(3)]
+        report = self.validator.report(records)
+        self.assertEqual(report.records, 3)
+        self.assertEqual(report.counts[('title', 'missing')], 3)
+        self.assertEqual(report.terms[('subjec', u'Leters')], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()